@@ -0,0 +1,406 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Bounded caches for rendered images
+
+Copyright (c) 2011--2024, IIHM/LIG - Renaud Blanch <http://iihm.imag.fr/blanch/>
+Licence: GPLv3 or higher <http://www.gnu.org/licenses/gpl.html>
+"""
+
+
+# imports ###################################################################
+
+import sys
+import os
+import mmap
+import time
+import struct
+import tempfile
+
+from collections import OrderedDict
+
+
+# lru cache #################################################################
+
+class LRUCache(object):
+	"""least recently used entries are evicted once the total size of the
+	entries exceeds the budget (the last entry put is always kept)"""
+	def __init__(self, budget):
+		self.budget = budget
+		self.size = 0
+		self.entries = OrderedDict() # key -> (value, size), oldest first
+		self.hits = self.misses = self.evictions = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def get(self, key, default=None):
+		try:
+			value, _ = self.entries[key]
+		except KeyError:
+			self.misses += 1
+			return default
+		self.entries.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def put(self, key, value, size):
+		self.discard(key)
+		self.entries[key] = value, size
+		self.size += size
+		while self.size > self.budget and len(self.entries) > 1:
+			_, (_, evicted_size) = self.entries.popitem(last=False)
+			self.size -= evicted_size
+			self.evictions += 1
+
+	def discard(self, key):
+		try:
+			_, size = self.entries.pop(key)
+		except KeyError:
+			return
+		self.size -= size
+
+	def clear(self):
+		self.entries.clear()
+		self.size = 0
+
+	def stats(self):
+		return "%d entries, %.1f/%.1fMB, %d hits, %d misses, %d evictions" % (
+			len(self.entries), self.size/(1<<20), self.budget/(1<<20),
+			self.hits, self.misses, self.evictions)
+
+
+# atlas #####################################################################
+
+# a single file of fixed width strips of rgba pixels, one per page:
+# - a header (magic, strip width in pixels, table capacity, table offset),
+# - a table of (content key, strip offset, strip height) indexed by page,
+#   moved to the end of the file with a larger capacity when pages are added,
+# - the strips, patched in place when a page keeps its height, appended
+#   otherwise.
+# strips are also looked up by content key, so that pages shifted by an
+# insertion or a deletion find theirs. The space left by replaced strips and
+# tables is reclaimed by copying the live strips to a new file, once it
+# exceeds ATLAS_COMPACT_RATIO times their size.
+
+ATLAS_MAGIC = b'ATLAS\x00\x00\x03'
+ATLAS_HEADER = struct.Struct('<8sIIQ')
+ATLAS_ENTRY = struct.Struct('<16sQI4x')
+ATLAS_EMPTY = (bytes(16), 0, 0)
+ATLAS_COMPACT_RATIO = 1
+
+class Atlas(object):
+	def __init__(self, path, width, count):
+		self.path = path
+		self.width = width
+		self.count = count
+		self.map = None
+		self.compactions = 0
+		self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+		self.load()
+		if self.capacity < count:
+			self.grow()
+		if self.wasted() > ATLAS_COMPACT_RATIO * self.live:
+			self.compact()
+
+	def load(self):
+		"""read the table, reset the file if it is not an atlas of this width"""
+		self.size = os.fstat(self.fd).st_size
+		header = os.pread(self.fd, ATLAS_HEADER.size, 0)
+		if len(header) < ATLAS_HEADER.size:
+			return self.reset()
+		magic, width, capacity, table = ATLAS_HEADER.unpack(header)
+		if magic != ATLAS_MAGIC or width != self.width or \
+		   table < ATLAS_HEADER.size or table + ATLAS_ENTRY.size*capacity > self.size:
+			return self.reset()
+		self.capacity, self.table = capacity, table
+		data = os.pread(self.fd, ATLAS_ENTRY.size*capacity, table)
+		self.entries = [ATLAS_ENTRY.unpack_from(data, i*ATLAS_ENTRY.size) for i in range(capacity)]
+		self.strips = {} # key -> (offset, height)
+		self.live = 0
+		for i, (key, offset, height) in enumerate(self.entries):
+			if offset == 0:
+				continue
+			if offset + self.strip_size(height) > self.size: # truncated
+				self.entries[i] = ATLAS_EMPTY
+				continue
+			self.strips[key] = offset, height
+			if i < self.count: # others are dropped by the next compaction
+				self.live += self.strip_size(height)
+
+	def reset(self):
+		os.ftruncate(self.fd, 0)
+		self.capacity, self.table = self.count, ATLAS_HEADER.size
+		self.entries = [ATLAS_EMPTY] * self.count
+		self.strips = {}
+		self.live = 0
+		os.pwrite(self.fd, self.header() + self.packed_table(), 0)
+		self.size = self.table + ATLAS_ENTRY.size*self.capacity
+
+	def header(self):
+		return ATLAS_HEADER.pack(ATLAS_MAGIC, self.width, self.capacity, self.table)
+
+	def packed_table(self):
+		return b''.join(ATLAS_ENTRY.pack(*entry) for entry in self.entries)
+
+	def strip_size(self, height):
+		return self.width*4*height
+
+	def wasted(self):
+		return self.size - ATLAS_HEADER.size - ATLAS_ENTRY.size*self.capacity - self.live
+
+	def grow(self):
+		"""move the table to the end of the file, with room for count pages"""
+		self.capacity = max(self.count, 2*self.capacity)
+		self.entries.extend([ATLAS_EMPTY] * (self.capacity - len(self.entries)))
+		self.table = self.size
+		os.pwrite(self.fd, self.packed_table(), self.table)
+		os.pwrite(self.fd, self.header(), 0) # once the table is complete
+		self.size += ATLAS_ENTRY.size*self.capacity
+
+	def compact(self):
+		"""copy the strips of the pages to a new file, replacing this one"""
+		mapped = self.mapped()
+		entries, strips = [], []
+		offset = ATLAS_HEADER.size + ATLAS_ENTRY.size*self.count
+		for key, strip_offset, height in self.entries[:self.count]:
+			if strip_offset == 0:
+				entries.append(ATLAS_EMPTY)
+				continue
+			strip_size = self.strip_size(height)
+			strips.append(mapped[strip_offset:strip_offset + strip_size])
+			entries.append((key, offset, height))
+			offset += strip_size
+		self.capacity, self.table, self.entries = self.count, ATLAS_HEADER.size, entries
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				f.write(self.header())
+				f.write(self.packed_table())
+				for strip in strips:
+					f.write(strip)
+			os.replace(tmp_path, self.path)
+		except OSError:
+			os.remove(tmp_path)
+			raise
+		self.map.close()
+		self.map = None
+		os.close(self.fd)
+		self.fd = os.open(self.path, os.O_RDWR)
+		self.load()
+		self.compactions += 1
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+		os.close(self.fd)
+
+	def mapped(self):
+		if self.map is None:
+			self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+		return self.map
+
+	def get(self, index, key, height):
+		"""return the pixels of the strip with the given key and height, the
+		one of page index first"""
+		stored_key, offset, stored_height = self.entries[index]
+		if offset == 0 or stored_key != key or stored_height != height:
+			offset, stored_height = self.strips.get(key, (0, 0))
+			if offset == 0 or stored_height != height:
+				return None
+		return self.mapped()[offset:offset + self.strip_size(height)]
+
+	def put(self, index, key, height, pixels):
+		assert len(pixels) == self.strip_size(height)
+		stored_key, offset, stored_height = self.entries[index]
+		if self.strips.get(stored_key) == (offset, stored_height): # replaced
+			del self.strips[stored_key]
+		if offset == 0 or stored_height != height:
+			if offset != 0:
+				self.live -= self.strip_size(stored_height)
+			offset = self.size
+			self.size += len(pixels)
+			self.live += len(pixels)
+			if self.map is not None: # remapped to the new size on next access
+				self.map.close()
+				self.map = None
+		os.pwrite(self.fd, pixels, offset)
+		self.entries[index] = key, offset, height
+		self.strips[key] = offset, height
+		os.pwrite(self.fd, ATLAS_ENTRY.pack(key, offset, height),
+		          self.table + index*ATLAS_ENTRY.size)
+		if self.wasted() > ATLAS_COMPACT_RATIO * self.live:
+			self.compact()
+
+
+# posters ###################################################################
+
+# one file per poster, named after its key (a digest of the movie file
+# identity, given by the caller): a header (magic, width, height) followed
+# by the rgba pixels. Files are written aside then renamed, so that a poster
+# is either complete or missing.
+# Reading a poster touches its file, and the least recently used ones are
+# removed once the files exceed the budget (posters of 1280x720 pixels weigh
+# 3.7MB each).
+
+POSTER_MAGIC = b'POSTER\x00\x01'
+POSTER_HEADER = struct.Struct('<8sII')
+POSTER_TMP_PREFIX = 'tmp'
+POSTERS_BUDGET = 256<<20 # in bytes
+
+class Posters(object):
+	def __init__(self, path, budget=POSTERS_BUDGET):
+		self.path = path
+		self.budget = budget
+		self.evictions = 0
+		os.makedirs(path, exist_ok=True)
+
+	def file_path(self, key):
+		return os.path.join(self.path, key.hex())
+
+	def get(self, key):
+		"""return (width, height, pixels) of the poster with key, if any"""
+		try:
+			with open(self.file_path(key), 'rb') as f:
+				data = f.read()
+		except OSError:
+			return None
+		if len(data) < POSTER_HEADER.size:
+			return None
+		magic, width, height = POSTER_HEADER.unpack_from(data)
+		pixels = data[POSTER_HEADER.size:]
+		if magic != POSTER_MAGIC or len(pixels) != width*4*height:
+			return None
+		try:
+			os.utime(self.file_path(key))
+		except OSError: # evicted meanwhile
+			pass
+		return width, height, pixels
+
+	def put(self, key, width, height, pixels):
+		assert len(pixels) == width*4*height
+		path = self.file_path(key)
+		fd, tmp_path = tempfile.mkstemp(prefix=POSTER_TMP_PREFIX, dir=self.path)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				f.write(POSTER_HEADER.pack(POSTER_MAGIC, width, height))
+				f.write(pixels)
+			os.replace(tmp_path, path)
+		except OSError:
+			os.remove(tmp_path)
+			raise
+		self.trim(keep=path)
+
+	def trim(self, keep=None):
+		"""remove the least recently used posters beyond the budget (but keep)"""
+		entries = []
+		with os.scandir(self.path) as scan:
+			for entry in scan:
+				if entry.name.startswith(POSTER_TMP_PREFIX): # being written
+					continue
+				try:
+					stat = entry.stat()
+				except OSError:
+					continue
+				entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+		size = sum(entry_size for _, entry_size, _ in entries)
+		for _, entry_size, path in sorted(entries):
+			if size <= self.budget:
+				break
+			if path == keep:
+				continue
+			try:
+				os.remove(path)
+			except OSError: # removed by another instance
+				continue
+			size -= entry_size
+			self.evictions += 1
+
+
+# benchmark #################################################################
+
+def main():
+	cache = LRUCache(64<<20)
+	start = time.time()
+	n = 100000
+	for i in range(n): # scrolling through 5000 pages, 30 visible at once
+		key = (i // 10 + i % 30) % 5000
+		if cache.get(key) is None:
+			cache.put(key, key, 115*87*4)
+	sys.stdout.write("%d lookups in %.1fms (%s)\n" % (
+		n, (time.time()-start)*1000, cache.stats()))
+	
+	width, height, n = 230, 174, 5000
+	pixels = bytes(width*4*height)
+	with tempfile.TemporaryDirectory() as path:
+		path = os.path.join(path, 'atlas')
+		atlas = Atlas(path, width, n)
+		start = time.time()
+		for i in range(n):
+			atlas.put(i, b'%16d' % i, height, pixels)
+		atlas.close()
+		write_time = time.time() - start
+		start = time.time()
+		atlas = Atlas(path, width, n)
+		for i in range(n):
+			assert atlas.get(i, b'%16d' % i, height) == pixels
+		atlas.close()
+		sys.stdout.write("%d strips written in %.1fms, read in %.1fms\n" % (
+			n, write_time*1000, (time.time()-start)*1000))
+		
+		n = 500 # a page inserted first, then all thumbnails enlarged
+		start = time.time()
+		atlas = Atlas(path, width, n+1)
+		assert atlas.compactions == 1 # pages beyond n+1 dropped
+		for i in range(n):
+			assert atlas.get(i+1, b'%16d' % i, height) == pixels
+		shift_time = time.time() - start
+		start = time.time()
+		larger = bytes(width*4*(height+1))
+		for i in range(n+1):
+			atlas.put(i, b'%16d' % (i-1), height+1, larger)
+		resize_time = time.time() - start
+		assert atlas.size <= (ATLAS_COMPACT_RATIO+1) * atlas.live + ATLAS_HEADER.size + ATLAS_ENTRY.size*(n+1)
+		assert os.path.getsize(path) == atlas.size
+		atlas.close()
+		resized = Atlas(path, width, n+1)
+		for i in range(n+1):
+			assert resized.get(i, b'%16d' % (i-1), height+1) == larger
+		resized.close()
+		sys.stdout.write("\t%d strips found shifted in %.1fms, resized in %.1fms "
+		                 "(%d compactions, %.1f/%.1fMB live)\n" % (
+			n, shift_time*1000, resize_time*1000, atlas.compactions,
+			atlas.live/(1<<20), atlas.size/(1<<20)))
+	
+	width, height, n = 1280, 720, 30
+	pixels = bytes(width*4*height)
+	with tempfile.TemporaryDirectory() as path:
+		posters = Posters(path)
+		start = time.time()
+		for i in range(n):
+			posters.put(b'%16d' % i, width, height, pixels)
+		write_time = time.time() - start
+		start = time.time()
+		for i in range(n):
+			assert posters.get(b'%16d' % i) == (width, height, pixels)
+		assert posters.get(b'%16d' % n) is None
+		read_time = time.time() - start
+		
+		poster_size = POSTER_HEADER.size + len(pixels)
+		posters.budget = n//2 * poster_size # the last posters read are kept
+		for i in range(n//2):
+			posters.get(b'%16d' % (2*i)) # mtimes are ordered despite their resolution
+			time.sleep(.001)
+		posters.put(b'%16d' % n, width, height, pixels)
+		kept = [i for i in range(n+1) if os.path.exists(posters.file_path(b'%16d' % i))]
+		assert kept == list(range(2, n, 2)) + [n], kept
+		sys.stdout.write("%d posters written in %.1fms, read in %.1fms, %d evicted to fit %.1fMB\n" % (
+			n, write_time*1000, read_time*1000, posters.evictions, posters.budget/(1<<20)))
+
+if __name__ == "__main__":
+	main()
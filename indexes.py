@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Indexes for constant or logarithmic time lookups while presenting
+
+Copyright (c) 2011--2024, IIHM/LIG - Renaud Blanch <http://iihm.imag.fr/blanch/>
+Licence: GPLv3 or higher <http://www.gnu.org/licenses/gpl.html>
+"""
+
+
+# imports ###################################################################
+
+import sys
+import time
+
+from math import floor
+from array import array
+from collections import defaultdict
+from bisect import bisect_left, bisect_right
+
+
+# strip layout ##############################################################
+
+class Strip(object):
+	"""items of given sizes stacked from the top, separated by a margin,
+	with their origins stored as prefix sums for bisect lookups"""
+	def __init__(self, sizes, margin):
+		self.sizes = list(sizes)
+		self.margin = margin
+		self.origins = []
+		self.ends = [] # origin of the next item
+		origin = 0
+		for _, height in self.sizes:
+			self.origins.append(origin)
+			origin += height + margin
+			self.ends.append(origin)
+		self.height = origin
+
+	def __len__(self):
+		return len(self.sizes)
+
+	def __getitem__(self, index):
+		width, height = self.sizes[index]
+		return width, height, self.origins[index]
+
+	def at(self, offset):
+		"""index of the item at offset (margin below an item included)"""
+		return min(bisect_right(self.ends, offset), len(self.sizes)-1)
+
+	def between(self, top, bottom):
+		"""range of the items overlapping [top, bottom]"""
+		return range(bisect_left(self.ends, top + self.margin),
+		             bisect_right(self.origins, bottom))
+
+
+# navigation ################################################################
+
+class Navigation(object):
+	"""pages grouped in frames (consecutive pages sharing a label) and sections"""
+	def __init__(self, labels, sections):
+		self.labels = list(labels)
+		self.page_count = len(self.labels)
+		self.label_pages = {}
+		self.starts = array('i') # frames as [start, end) ranges
+		self.ends = array('i')
+		self.page_frames = array('i')
+		current_label = None
+		for page, label in enumerate(self.labels):
+			self.label_pages.setdefault(label, page)
+			if page == 0 or label != current_label:
+				if self.starts:
+					self.ends.append(page)
+				self.starts.append(page)
+				current_label = label
+			self.page_frames.append(len(self.starts)-1)
+		if self.starts:
+			self.ends.append(self.page_count)
+		self.sections = array('i', sorted(set(sections)))
+		self.page_sections = array('i', (
+			bisect_right(self.sections, page) - 1 for page in range(self.page_count)))
+
+	def frames(self):
+		return zip(self.starts, self.ends)
+
+	def frame(self, page):
+		"""(start, end) of the frame of page"""
+		frame = self.page_frames[page]
+		return self.starts[frame], self.ends[frame]
+
+	def section(self, page):
+		"""index of the section of page, -1 before the first section"""
+		return self.page_sections[page]
+
+	def page(self, label):
+		"""first page with label, if any"""
+		return self.label_pages.get(label)
+
+	def next(self, index, page):
+		"""first page of index after page, or page if none"""
+		i = bisect_right(index, page)
+		return index[i] if i < len(index) else page
+
+	def prev(self, index, page):
+		"""last page of index before page, or page if none"""
+		i = bisect_left(index, page)
+		return index[i-1] if i else page
+
+
+# rect grid #################################################################
+
+GRID_CELL = 64. # in page units
+
+class Grid(object):
+	"""rects ((x, y), (w, h)) bucketed in square cells, later rects being
+	above earlier ones (as annotations on a page)"""
+	def __init__(self, rects, cell=GRID_CELL):
+		self.rects = [((x, y), (w, h)) for (x, y), (w, h) in rects]
+		self.cell = cell
+		self.cells = defaultdict(list)
+		for i, ((x, y), (w, h)) in enumerate(self.rects):
+			for cx in range(floor(x/cell), floor((x+w)/cell)+1):
+				for cy in range(floor(y/cell), floor((y+h)/cell)+1):
+					self.cells[cx, cy].append(i)
+
+	def __len__(self):
+		return len(self.rects)
+
+	def at(self, x, y):
+		"""indices of the rects containing (x, y), topmost first"""
+		hits = []
+		for i in reversed(self.cells.get((floor(x/self.cell), floor(y/self.cell)), ())):
+			(rx, ry), (rw, rh) = self.rects[i]
+			if rx <= x <= rx+rw and ry <= y <= ry+rh:
+				hits.append(i)
+		return hits
+
+	def within(self, rect):
+		"""indices of the rects overlapping rect, bottommost first"""
+		(x, y), (w, h) = rect
+		candidates = set()
+		for cx in range(floor(x/self.cell), floor((x+w)/self.cell)+1):
+			for cy in range(floor(y/self.cell), floor((y+h)/self.cell)+1):
+				candidates.update(self.cells.get((cx, cy), ()))
+		hits = []
+		for i in sorted(candidates):
+			(rx, ry), (rw, rh) = self.rects[i]
+			if rx <= x+w and x <= rx+rw and ry <= y+h and y <= ry+rh:
+				hits.append(i)
+		return hits
+
+
+# benchmark #################################################################
+
+def main():
+	n, margin, view = 5000, 5, 800
+	strip = Strip([(115, 65 + i % 3 * 20) for i in range(n)], margin)
+	events = 10000
+	offsets = [strip.height * i / events for i in range(events)]
+
+	start = time.time()
+	for offset in offsets:
+		strip.at(offset)
+		strip.between(offset - view, offset + 2*view)
+	indexed = (time.time()-start) / events
+
+	start = time.time()
+	for offset in offsets[::100]: # linear walk, as before
+		for i in range(n):
+			_, h, o = strip[i]
+			if o + h + margin > offset:
+				break
+		visible = [i for i in range(n) if offset - view <= strip[i][2] + strip[i][1]
+		                               and strip[i][2] <= offset + 2*view]
+	linear = (time.time()-start) / (events / 100)
+
+	sys.stdout.write("%d pages: %.1fµs per event (linear: %.1fµs)\n" % (
+		n, indexed*1e6, linear*1e6))
+	
+	navigation = Navigation([str(i // 8) for i in range(n)], range(0, n, 200))
+	start = time.time()
+	for page in range(n):
+		navigation.next(navigation.starts, page)
+		navigation.prev(navigation.sections, page)
+		navigation.frame(page)
+		navigation.page(str(page))
+	sys.stdout.write("%d pages: %.1fµs per navigation\n" % (
+		n, (time.time()-start) / n * 1e6))
+	
+	# an index page: 40 lines of 12 links
+	rects = [((50 + 45*i, 50 + 12*j), (40, 10)) for j in range(40) for i in range(12)]
+	grid = Grid(rects)
+	points = [(x*.37 % 600, y*.71 % 550) for x in range(100) for y in range(100)]
+	start = time.time()
+	for x, y in points:
+		grid.at(x, y)
+	indexed = (time.time()-start) / len(points)
+	start = time.time()
+	for x, y in points[::100]: # linear scan, as before
+		[i for i, ((rx, ry), (rw, rh)) in enumerate(rects) if rx <= x <= rx+rw and ry <= y <= ry+rh]
+	linear = (time.time()-start) / (len(points) / 100)
+	assert all(grid.at(x, y) == [i for i, ((rx, ry), (rw, rh)) in reversed(list(enumerate(rects)))
+	                             if rx <= x <= rx+rw and ry <= y <= ry+rh] for x, y in points)
+	sys.stdout.write("%d links: %.1fµs per hit test (linear: %.1fµs)\n" % (
+		len(rects), indexed*1e6, linear*1e6))
+
+if __name__ == "__main__":
+	main()
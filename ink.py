@@ -0,0 +1,831 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Compact storage of the strokes drawn on pages
+
+Copyright (c) 2011--2024, IIHM/LIG - Renaud Blanch <http://iihm.imag.fr/blanch/>
+Licence: GPLv3 or higher <http://www.gnu.org/licenses/gpl.html>
+"""
+
+
+# imports ###################################################################
+
+import sys
+import os
+import time
+import random
+import shutil
+import tempfile
+import itertools
+
+from math import pi as _pi, sin as _sin, cos as _cos, floor
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque
+
+import pdfreader
+import pdfwriter
+from pdfwriter import NewStream, Raw
+
+
+# strokes ###################################################################
+
+# strokes are stored as columns of contiguous arrays:
+# - points:  x, y float pairs, stroke after stroke,
+# - offsets: index of the first point of each stroke, plus the point count,
+# - ids:     unique and increasing stroke identifiers (bisect lookups),
+# - colors:  r, g, b, a per stroke,
+# - widths:  line width per stroke,
+# - bboxes:  x0, y0, x1, y1 per stroke.
+#
+# points are simplified as they arrive: the last point of the stroke being
+# drawn is moved rather than a point added, as long as the points received
+# since the previous one stay within tolerance of the line from it (an online
+# variant of Douglas-Peucker), strokes are then drawn as smooth curves through
+# their points (Catmull-Rom splines).
+#
+# deleting (or restoring) a few runs of consecutive strokes splices the
+# columns in place, only the offsets after the first of them are rewritten.
+#
+# a grid indexes strokes by the cells of their points for selection queries,
+# and a selection is moved by composing a pending matrix per stroke, applied
+# when the stroke is drawn and baked into its points once done.
+
+_ids = itertools.count(1)
+
+GRID_CELL = 64. # in page units
+
+MAX_RUN = 32 # points checked against the current line, bounds the cost per point
+MAX_SPLICES = 8 # runs of strokes deleted or restored in place, above the columns are rebuilt
+
+def distance(p, a, b):
+	"""distance from point p to the segment [a, b]"""
+	(px, py), (ax, ay), (bx, by) = p, a, b
+	dx, dy = bx-ax, by-ay
+	l2 = dx*dx + dy*dy
+	t = 0. if l2 == 0. else max(0., min(1., ((px-ax)*dx + (py-ay)*dy) / l2))
+	x, y = ax + t*dx - px, ay + t*dy - py
+	return (x*x + y*y) ** .5
+
+IDENTITY = (1., 0., 0., 1., 0., 0.)
+
+def compose(m, n):
+	"""matrix applying m then n"""
+	a11, a12, a21, a22, atX, atY = m
+	b11, b12, b21, b22, btX, btY = n
+	return (
+		a11*b11 + a12*b21, a11*b12 + a12*b22,
+		a21*b11 + a22*b21, a21*b12 + a22*b22,
+		atX*b11 + atY*b21 + btX, atX*b12 + atY*b22 + btY,
+	)
+
+def apply(matrix, xs, ys):
+	m11, m12, m21, m22, tX, tY = matrix
+	return (array('f', (m11*x + m21*y + tX for x, y in zip(xs, ys))),
+	        array('f', (m12*x + m22*y + tY for x, y in zip(xs, ys))))
+
+def cell(x, y):
+	return int(floor(x / GRID_CELL)), int(floor(y / GRID_CELL))
+
+class Strokes(object):
+	def __init__(self):
+		self.points  = array('f')
+		self.offsets = array('I', [0])
+		self.ids     = array('Q')
+		self.colors  = array('f')
+		self.widths  = array('f')
+		self.bboxes  = array('f')
+		self.run = [] # points received since the previous point of the last stroke
+		self.cells = defaultdict(set) # (column, row) -> ids of strokes with points in it
+		self.stroke_cells = {} # stroke id -> cells it is indexed in
+		self.pending = {} # stroke id -> matrix not yet applied to its points
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __getstate__(self):
+		"""copies of the columns and pending matrices (that may be pickled later)"""
+		return (self.points[:], self.offsets[:], self.ids[:], self.colors[:],
+		        self.widths[:], self.bboxes[:], dict(self.pending))
+
+	def __setstate__(self, state):
+		global _ids
+		self.__init__()
+		(self.points, self.offsets, self.ids, self.colors,
+		 self.widths, self.bboxes, self.pending) = state
+		for i in range(len(self.ids)):
+			self.index_stroke(i)
+		if self.ids: # ids of strokes added later must stay increasing
+			_ids = itertools.count(max(next(_ids), self.ids[-1]+1))
+
+	def index(self, stroke_id):
+		"""index of the stroke with stroke_id, None if deleted"""
+		i = bisect_left(self.ids, stroke_id)
+		if i < len(self.ids) and self.ids[i] == stroke_id:
+			return i
+		return None
+
+	def add(self, x, y, color, width):
+		"""start a new stroke at (x, y), return its id"""
+		stroke_id = next(_ids)
+		self.ids.append(stroke_id)
+		self.points.extend((x, y))
+		self.offsets.append(self.offsets[-1] + 1)
+		self.colors.extend(color)
+		self.widths.append(width)
+		self.bboxes.extend((x, y, x, y))
+		self.run = []
+		c = cell(x, y)
+		self.cells[c].add(stroke_id)
+		self.stroke_cells[stroke_id] = {c}
+		return stroke_id
+
+	def add_point(self, x, y, tolerance=0.):
+		"""extend the last stroke to (x, y), simplified within tolerance"""
+		i = len(self.ids)-1
+		p = x, y
+		c = cell(x, y) # the cells of moved points are kept
+		self.cells[c].add(self.ids[i])
+		self.stroke_cells[self.ids[i]].add(c)
+		if tolerance > 0. and self.point_count(i) > 1 and len(self.run) < MAX_RUN:
+			a = self.point(i, -2)
+			if all(distance(q, a, p) <= tolerance for q in self.run):
+				self.points[-2], self.points[-1] = x, y # moving the last point
+				self.run.append(p)
+				self.extend_bbox(i, x, y)
+				return
+		self.points.extend(p)
+		self.offsets[-1] += 1
+		self.run = [p]
+		self.extend_bbox(i, x, y)
+
+	def extend_bbox(self, i, x, y):
+		bboxes, b = self.bboxes, 4*i
+		if x < bboxes[b]:   bboxes[b]   = x
+		if y < bboxes[b+1]: bboxes[b+1] = y
+		if x > bboxes[b+2]: bboxes[b+2] = x
+		if y > bboxes[b+3]: bboxes[b+3] = y
+
+	def point_count(self, i):
+		return self.offsets[i+1] - self.offsets[i]
+
+	def stroke_points(self, i):
+		"""x, y pairs of stroke i"""
+		return self.points[2*self.offsets[i]:2*self.offsets[i+1]]
+
+	def point(self, i, n):
+		"""n-th point of stroke i (negative n count from the end)"""
+		if n < 0:
+			n += self.point_count(i)
+		p = 2*(self.offsets[i] + n)
+		return self.points[p], self.points[p+1]
+
+	def curve(self, i):
+		"""start point and (control point 1, control point 2, end point) cubic
+		segments of the Catmull-Rom spline through the points of stroke i,
+		its pending matrix applied"""
+		points = self.stroke_points(i)
+		xs, ys = points[0::2], points[1::2]
+		matrix = self.pending.get(self.ids[i])
+		if matrix is not None:
+			xs, ys = apply(matrix, xs, ys)
+		# neighbours of each segment [1, 2], with end points repeated
+		x0s, y0s = xs[:1] + xs[:-2], ys[:1] + ys[:-2]
+		x1s, y1s = xs[:-1], ys[:-1]
+		x2s, y2s = xs[1:], ys[1:]
+		x3s, y3s = xs[2:] + xs[-1:], ys[2:] + ys[-1:]
+		segments = [
+			((x1 + (x2-x0)/6., y1 + (y2-y0)/6.), (x2 - (x3-x1)/6., y2 - (y3-y1)/6.), (x2, y2))
+			for x0, y0, x1, y1, x2, y2, x3, y3 in zip(x0s, y0s, x1s, y1s, x2s, y2s, x3s, y3s)
+		]
+		return (xs[0], ys[0]), segments
+
+	def color(self, i):
+		return tuple(self.colors[4*i:4*i+4])
+
+	def width(self, i):
+		return self.widths[i]
+
+	def bbox(self, i):
+		return tuple(self.bboxes[4*i:4*i+4])
+
+	def runs(self, indices):
+		"""runs (first, last) of consecutive indices, last first"""
+		runs = []
+		for i in sorted(indices, reverse=True):
+			if runs and runs[-1][0] == i+1:
+				runs[-1] = i, runs[-1][1]
+			else:
+				runs.append((i, i+1))
+		return runs
+
+	def splice_offsets(self, first, counts):
+		"""offsets of the strokes from first on, given their point counts"""
+		offsets = self.offsets
+		del offsets[first+1:]
+		offset = offsets[first]
+		for count in counts:
+			offset += count
+			offsets.append(offset)
+
+	def delete(self, indices):
+		"""remove the strokes at indices, splicing the columns when they are
+		few runs of consecutive strokes, compacting them in one pass otherwise"""
+		deleted = set(indices)
+		if not deleted:
+			return
+		self.unindex(deleted)
+		for i in deleted:
+			self.pending.pop(self.ids[i], None)
+		self.run = []
+		n = len(self.ids)
+		runs = self.runs(deleted)
+		if len(runs) <= MAX_SPLICES:
+			first = runs[-1][0]
+			counts = [self.point_count(i) for i in range(first, n) if i not in deleted]
+			for a, b in runs: # from the last, the offsets before a stay valid
+				del self.points[2*self.offsets[a]:2*self.offsets[b]]
+				del self.ids[a:b]
+				del self.widths[a:b]
+				del self.colors[4*a:4*b]
+				del self.bboxes[4*a:4*b]
+			self.splice_offsets(first, counts)
+			return
+		kept = [i for i in range(n) if i not in deleted]
+		points = array('f')
+		offsets = array('I', [0])
+		for i in kept:
+			points.extend(self.points[2*self.offsets[i]:2*self.offsets[i+1]])
+			offsets.append(len(points)//2)
+		self.points, self.offsets = points, offsets
+		self.ids    = array('Q', (self.ids[i] for i in kept))
+		self.widths = array('f', (self.widths[i] for i in kept))
+		self.colors = array('f', (c for i in kept for c in self.colors[4*i:4*i+4]))
+		self.bboxes = array('f', (c for i in kept for c in self.bboxes[4*i:4*i+4]))
+
+	def clear(self):
+		self.delete(range(len(self.ids)))
+
+	def extract(self, indices):
+		"""remove the strokes at indices, and return them (to be restored)"""
+		fragment = Strokes()
+		indices = sorted(set(indices))
+		for i in indices:
+			first, last = self.offsets[i], self.offsets[i+1]
+			fragment.points.extend(self.points[2*first:2*last])
+			fragment.offsets.append(fragment.offsets[-1] + last - first)
+			fragment.ids.append(self.ids[i])
+			fragment.colors.extend(self.colors[4*i:4*i+4])
+			fragment.widths.append(self.widths[i])
+			fragment.bboxes.extend(self.bboxes[4*i:4*i+4])
+			if self.ids[i] in self.pending:
+				fragment.pending[self.ids[i]] = self.pending[self.ids[i]]
+		self.delete(indices)
+		return fragment
+
+	def restore(self, fragment):
+		"""put back extracted strokes, in the order of their ids"""
+		if not fragment.ids:
+			return
+		n = len(self.ids)
+		positions = [bisect_left(self.ids, stroke_id) for stroke_id in fragment.ids]
+		runs = [] # (first, last) fragment strokes inserted at the same position
+		for j, position in enumerate(positions):
+			if runs and positions[runs[-1][0]] == position:
+				runs[-1] = runs[-1][0], j+1
+			else:
+				runs.append((j, j+1))
+		if len(runs) <= MAX_SPLICES:
+			first = positions[0]
+			counts, j = [], 0
+			for i in range(first, n+1):
+				while j < len(positions) and positions[j] == i:
+					counts.append(fragment.point_count(j))
+					j += 1
+				if i < n:
+					counts.append(self.point_count(i))
+			for a, b in reversed(runs): # from the last, the offsets before i stay valid
+				i = positions[a]
+				p, q, r = 2*self.offsets[i], 2*fragment.offsets[a], 2*fragment.offsets[b]
+				self.points[p:p] = fragment.points[q:r]
+				self.ids[i:i] = fragment.ids[a:b]
+				self.widths[i:i] = fragment.widths[a:b]
+				self.colors[4*i:4*i] = fragment.colors[4*a:4*b]
+				self.bboxes[4*i:4*i] = fragment.bboxes[4*a:4*b]
+			self.splice_offsets(first, counts)
+		else:
+			merged = sorted([(stroke_id, self, i) for i, stroke_id in enumerate(self.ids)] +
+			                [(stroke_id, fragment, i) for i, stroke_id in enumerate(fragment.ids)])
+			points, offsets = array('f'), array('I', [0])
+			ids, colors, widths, bboxes = array('Q'), array('f'), array('f'), array('f')
+			for stroke_id, strokes, i in merged:
+				points.extend(strokes.points[2*strokes.offsets[i]:2*strokes.offsets[i+1]])
+				offsets.append(len(points)//2)
+				ids.append(stroke_id)
+				colors.extend(strokes.colors[4*i:4*i+4])
+				widths.append(strokes.widths[i])
+				bboxes.extend(strokes.bboxes[4*i:4*i+4])
+			self.points, self.offsets, self.ids = points, offsets, ids
+			self.colors, self.widths, self.bboxes = colors, widths, bboxes
+		self.pending.update(fragment.pending)
+		self.run = []
+		for stroke_id in fragment.ids:
+			self.index_stroke(self.index(stroke_id))
+
+	def index_cells(self, i):
+		points = self.stroke_points(i)
+		return {cell(x, y) for x, y in zip(points[0::2], points[1::2])}
+
+	def index_stroke(self, i):
+		stroke_id = self.ids[i]
+		cells = self.stroke_cells[stroke_id] = self.index_cells(i)
+		for c in cells:
+			self.cells[c].add(stroke_id)
+
+	def unindex(self, indices):
+		"""remove the strokes at indices from all the cells they were put in"""
+		for i in indices:
+			stroke_id = self.ids[i]
+			for c in self.stroke_cells.pop(stroke_id, ()):
+				self.cells[c].discard(stroke_id)
+				if not self.cells[c]:
+					del self.cells[c]
+
+	def transform(self, indices, matrix):
+		"""apply the affine matrix (m11, m12, m21, m22, tX, tY) to the strokes at
+		indices, as NSAffineTransform does"""
+		indices = list(indices)
+		self.unindex(indices)
+		points = self.points
+		for i in indices:
+			first, last = 2*self.offsets[i], 2*self.offsets[i+1]
+			xs, ys = apply(matrix, points[first:last:2], points[first+1:last:2])
+			points[first:last:2], points[first+1:last:2] = xs, ys
+			self.bboxes[4*i:4*i+4] = array('f', (min(xs), min(ys), max(xs), max(ys)))
+			self.index_stroke(i)
+
+	def defer(self, indices, matrix):
+		"""compose matrix with the pending matrices of the strokes at indices"""
+		for i in indices:
+			stroke_id = self.ids[i]
+			self.pending[stroke_id] = compose(self.pending.get(stroke_id, IDENTITY), matrix)
+
+	def bake(self):
+		"""apply the pending matrices to the points"""
+		pending, self.pending = self.pending, {}
+		for stroke_id, matrix in pending.items():
+			i = self.index(stroke_id)
+			if i is not None:
+				self.transform([i], matrix)
+
+	def select(self, rect):
+		"""indices of the strokes within rect ((x, y), (w, h)), or ending in it"""
+		self.bake()
+		(x, y), (w, h) = rect
+		(c0, r0), (c1, r1) = cell(x, y), cell(x+w, y+h)
+		candidates = set()
+		for c in range(c0, c1+1):
+			for r in range(r0, r1+1):
+				candidates.update(self.cells.get((c, r), ()))
+		selected = []
+		for i in sorted(i for i in map(self.index, candidates) if i is not None):
+			x0, y0, x1, y1 = self.bboxes[4*i:4*i+4]
+			ex, ey = self.point(i, -1)
+			if (x <= x0 and x1 <= x+w and y <= y0 and y1 <= y+h) or \
+			   (x <= ex <= x+w and y <= ey <= y+h):
+				selected.append(i)
+		return selected
+
+
+# history #################################################################
+
+# edits of strokes are commands, done when created, that can be undone and
+# redone. The history keeps at most HISTORY_LENGTH of them, and drops the
+# oldest when the points they hold (deleted strokes) exceed HISTORY_BUDGET.
+# Successive transforms of the same strokes are merged into a single command.
+
+HISTORY_LENGTH = 1000
+HISTORY_BUDGET = 1<<20 # in points
+MERGE_DELAY = 1. # in seconds
+
+def invert(matrix):
+	m11, m12, m21, m22, tX, tY = matrix
+	d = m11*m22 - m12*m21
+	i11, i12, i21, i22 = m22/d, -m12/d, -m21/d, m11/d
+	return i11, i12, i21, i22, -(tX*i11 + tY*i21), -(tX*i12 + tY*i22)
+
+class History(object):
+	def __init__(self, length=HISTORY_LENGTH, budget=HISTORY_BUDGET):
+		self.length = length
+		self.budget = budget
+		self.size = 0
+		self.done = deque()
+		self.undone = []
+
+	def push(self, command):
+		self.size -= sum(undone.size for undone in self.undone)
+		self.undone.clear()
+		if self.done and self.done[-1].merge(command):
+			return
+		self.done.append(command)
+		self.size += command.size
+		while len(self.done) > self.length or (self.size > self.budget and len(self.done) > 1):
+			self.size -= self.done.popleft().size
+
+	def undo(self):
+		"""undo the last command and return it, if any"""
+		if not self.done:
+			return None
+		command = self.done.pop()
+		command.undo()
+		self.undone.append(command)
+		return command
+
+	def redo(self):
+		if not self.undone:
+			return None
+		command = self.undone.pop()
+		command.redo()
+		self.done.append(command)
+		return command
+
+
+class Command(object):
+	size = 0 # points held
+	pages = []
+
+	def merge(self, command):
+		return False
+
+class AddStroke(Command):
+	def __init__(self, drawings, page, stroke_id):
+		self.drawings = drawings
+		self.pages = [page]
+		self.stroke_id = stroke_id
+		strokes = drawings[page]
+		self.size = strokes.point_count(strokes.index(stroke_id))
+		self.fragment = None
+
+	def undo(self):
+		strokes = self.drawings[self.pages[0]]
+		i = strokes.index(self.stroke_id)
+		self.fragment = strokes.extract([] if i is None else [i])
+
+	def redo(self):
+		self.drawings[self.pages[0]].restore(self.fragment)
+		self.fragment = None
+
+class DeleteStrokes(Command):
+	def __init__(self, drawings, indices):
+		"""delete the strokes at indices ({page: indices})"""
+		self.drawings = drawings
+		self.pages = list(indices)
+		self.ids = {page: [drawings[page].ids[i] for i in page_indices]
+		            for page, page_indices in indices.items()}
+		self.redo()
+		self.size = sum(len(fragment.points)//2 for fragment in self.fragments.values())
+
+	def undo(self):
+		for page, fragment in self.fragments.items():
+			self.drawings[page].restore(fragment)
+		self.fragments = {}
+
+	def redo(self):
+		self.fragments = {}
+		for page, ids in self.ids.items():
+			strokes = self.drawings[page]
+			self.fragments[page] = strokes.extract(
+				i for i in map(strokes.index, ids) if i is not None)
+
+class TransformStrokes(Command):
+	def __init__(self, drawings, page, ids, matrix):
+		"""transform the strokes with ids on page (deferred until baked)"""
+		self.drawings = drawings
+		self.pages = [page]
+		self.ids = sorted(ids)
+		self.matrix = matrix
+		self.time = time.time()
+		self.apply(matrix)
+
+	def apply(self, matrix):
+		strokes = self.drawings[self.pages[0]]
+		strokes.defer([i for i in map(strokes.index, self.ids) if i is not None], matrix)
+
+	def undo(self):
+		self.apply(invert(self.matrix))
+
+	def redo(self):
+		self.apply(self.matrix)
+
+	def merge(self, command):
+		if not isinstance(command, TransformStrokes) or command.pages != self.pages or \
+		   command.ids != self.ids or command.time - self.time > MERGE_DELAY:
+			return False
+		self.matrix = compose(self.matrix, command.matrix)
+		self.time = command.time
+		return True
+
+
+# pdf export ################################################################
+
+# strokes are written as Ink annotations (with an appearance stream drawing
+# their curves) in an incremental update of a copy of the document: each page
+# with strokes is written again with the new annotations appended to its
+# /Annots, the board strokes going to a new last page of the board size.
+# Strokes are expected in the (unrotated) default user space of their page.
+
+def _numbers(values, separator=b' '):
+	return (b'%.2f' + separator) * len(values) % tuple(values)
+
+def ink_annotation(strokes, i, page_ref, appearance_ref):
+	x0, y0, x1, y1 = strokes.bbox(i)
+	w = strokes.width(i)
+	r, g, b, a = strokes.color(i)
+	return {
+		'Type': 'Annot', 'Subtype': 'Ink', 'F': 4, 'P': page_ref,
+		'Rect': [x0-w, y0-w, x1+w, y1+w],
+		'InkList': Raw(b'[[' + _numbers(strokes.stroke_points(i)) + b']]'),
+		'C': [r, g, b], 'CA': a,
+		'BS': {'Type': 'Border', 'W': w, 'S': 'S'},
+		'AP': {'N': appearance_ref},
+	}
+
+def ink_appearance(strokes, i):
+	x0, y0, x1, y1 = strokes.bbox(i)
+	w = strokes.width(i)
+	r, g, b, a = strokes.color(i)
+	start, segments = strokes.curve(i)
+	content = [b'/G gs 1 J 1 j %.2f w %sRG' % (w, _numbers((r, g, b))),
+	           _numbers(start) + b'm',
+	           (b'%.2f %.2f %.2f %.2f %.2f %.2f c\n' * len(segments)) %
+	               tuple(v for segment in segments for point in segment for v in point),
+	           b'S']
+	return NewStream({
+		'Type': 'XObject', 'Subtype': 'Form',
+		'BBox': [x0-w, y0-w, x1+w, y1+w],
+		'Resources': {'ExtGState': {'G': {'Type': 'ExtGState', 'CA': a}}},
+	}, b'\n'.join(content))
+
+def write_annotations(update, strokes, page_ref):
+	"""write the annotations of strokes, return their references"""
+	strokes.bake()
+	refs = []
+	for i in range(len(strokes)):
+		annotation_ref, appearance_ref = update.new_ref(), update.new_ref()
+		update.write(appearance_ref, ink_appearance(strokes, i))
+		update.write(annotation_ref, ink_annotation(strokes, i, page_ref, appearance_ref))
+		refs.append(annotation_ref)
+	return refs
+
+def export(document, path, pages, board=None):
+	"""write document with the strokes of pages ({page index: Strokes}) and of
+	board ((Strokes, (width, height)), on a new page) to path"""
+	if os.path.abspath(path) != os.path.abspath(document.path):
+		shutil.copyfile(document.path, path)
+	page_refs = document.page_refs()
+	with open(path, 'ab') as out:
+		update = pdfwriter.IncrementalUpdate(document, out)
+		for page_number, strokes in sorted(pages.items()):
+			page_ref = page_refs[page_number]
+			if not strokes or page_ref is None:
+				continue
+			page = dict(document.page(page_number))
+			annotations = document.resolve(page.get('Annots')) or []
+			page['Annots'] = list(annotations) + write_annotations(update, strokes, page_ref)
+			update.write(page_ref, page)
+		
+		if board is not None and board[0]:
+			strokes, (width, height) = board
+			pages_ref = document.catalog['Pages']
+			board_ref = update.new_ref()
+			update.write(board_ref, {
+				'Type': 'Page', 'Parent': pages_ref,
+				'MediaBox': [0, 0, width, height], 'Resources': {},
+				'Annots': write_annotations(update, strokes, board_ref),
+			})
+			root = dict(document.resolve(pages_ref))
+			root['Kids'] = list(document.resolve(root['Kids'])) + [board_ref]
+			root['Count'] = document.resolve(root['Count']) + 1
+			update.write(pages_ref, root)
+		update.close()
+
+
+# benchmark #################################################################
+
+def pen_trace(seed, duration=3., rate=120., speed=1.):
+	"""synthetic handwriting: loops drifting to the right (2 to 5 per second
+	at full speed), sampled as a pen tablet would, with a pixel of jitter"""
+	rng = random.Random(seed)
+	a, b = rng.uniform(20, 40), rng.uniform(2, 5) * speed
+	trace = []
+	for k in range(int(duration*rate)):
+		t = k / rate
+		trace.append((
+			30*speed*t + a*.5*_cos(2*_pi*b*t) + rng.uniform(-.5, .5),
+			a*_sin(2*_pi*b*t) * (1 + .3*_sin(_pi*t)) + rng.uniform(-.5, .5),
+		))
+	return trace
+
+def trace_error(strokes, i, trace):
+	"""largest distance from the points of trace to the segments of stroke i
+	they were simplified into (the points kept are points of the trace)"""
+	points = strokes.stroke_points(i)
+	kept = list(zip(points[0::2], points[1::2]))
+	rounded = array('f', (c for p in trace for c in p)) # as stored
+	error, k = 0., 0
+	for p in zip(rounded[0::2], rounded[1::2]):
+		if k+1 == len(kept):
+			break
+		if p == kept[k+1]:
+			k += 1
+		else:
+			error = max(error, distance(p, kept[k], kept[k+1]))
+	return error
+
+def simplification_benchmark():
+	for speed in [1., .5, .25]:
+		traces = [pen_trace(seed, speed=speed) for seed in range(20)]
+		raw_points = sum(len(trace) for trace in traces)
+		sys.stdout.write("handwriting at %.2f speed:\n" % speed)
+		for tolerance in [0., .5, 1., 1.5, 2.]:
+			strokes = Strokes()
+			start = time.time()
+			for trace in traces:
+				(x, y), *trace = trace
+				strokes.add(x, y, (0., 0., 0., 1.), 1.)
+				for x, y in trace:
+					strokes.add_point(x, y, tolerance)
+			add_time = time.time() - start
+			
+			start = time.time() # what a redraw computes before stroking
+			segments = sum(len(strokes.curve(i)[1]) for i in range(len(strokes)))
+			curve_time = time.time() - start
+			
+			error = max(trace_error(strokes, i, trace) for i, trace in enumerate(traces))
+			sys.stdout.write("\ttolerance %.2f: %d -> %d points (/%.1f), %.1fµs per point, "
+			                 "max error %.2f, %d curve segments in %.1fms\n" % (
+				tolerance, raw_points, len(strokes.points)//2, raw_points/(len(strokes.points)//2),
+				add_time/raw_points*1e6, error, segments, curve_time*1000))
+
+def export_benchmark():
+	page_count = 300
+	traces = [pen_trace(seed) for seed in range(20)]
+	pages = defaultdict(Strokes)
+	for page_number in range(0, page_count, 3):
+		for trace in traces[page_number % 7:][:5]:
+			(x, y), *trace = trace
+			pages[page_number].add(x, y+200, (1., 0., 0., 1.), 2.)
+			for x, y in trace:
+				pages[page_number].add_point(x, y+200, .5)
+	board = Strokes()
+	for trace in traces:
+		(x, y), *trace = trace
+		board.add(x, y, (0., 0., 1., .5), 3.)
+		for x, y in trace:
+			board.add_point(x, y, .5)
+	points = sum(len(strokes.points)//2 for strokes in list(pages.values()) + [board])
+	
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'slides.pdf')
+		pdfwriter.sample_document(path, page_count)
+		document = pdfreader.Document(path)
+		start = time.time()
+		export(document, os.path.join(directory, 'annotated.pdf'), pages, (board, (640, 480)))
+		export_time = time.time() - start
+		document.close()
+		
+		document = pdfreader.Document(os.path.join(directory, 'annotated.pdf'))
+		assert document.page_count == page_count + 1
+		annotations = sum(len(document.get(page, 'Annots')) for page in document.pages() if 'Annots' in page)
+		assert annotations == sum(len(strokes) for strokes in pages.values()) + len(board)
+		document.close()
+	sys.stdout.write("%d strokes (%d points) on %d pages exported in %.1fms\n" % (
+		annotations, points, len(pages)+1, export_time*1000))
+
+def history_benchmark():
+	n, m = 5000, 100 # strokes drawn on 10 pages, with an erase every 50 strokes
+	drawings = defaultdict(Strokes)
+	history = History()
+	start = time.time()
+	for i in range(n):
+		page = i % 10
+		strokes = drawings[page]
+		stroke_id = strokes.add(i, 0, (0., 0., 0., 1.), 1.)
+		for j in range(1, m):
+			strokes.add_point(i, j)
+		history.push(AddStroke(drawings, page, stroke_id))
+		history.push(TransformStrokes(drawings, page, [stroke_id], (1., 0., 0., 1., 1., 1.)))
+		if i % 50 == 49:
+			history.push(DeleteStrokes(drawings, {page: range(len(strokes))}))
+	edit_time = time.time() - start
+	
+	undos = len(history.done)
+	start = time.time()
+	while history.undo():
+		pass
+	undo_time = time.time() - start
+	start = time.time()
+	while history.redo():
+		pass
+	redo_time = time.time() - start
+	sys.stdout.write("%d commands kept (%d points held), undone in %.1fµs, "
+	                 "redone in %.1fµs each (edits in %.1fms)\n" % (
+		undos, history.size, undo_time/undos*1e6, redo_time/undos*1e6, edit_time*1000))
+	
+	n, m = 5000, 200 # a stroke deleted in the middle of a page of 1M points
+	drawings = defaultdict(Strokes)
+	strokes = drawings[0]
+	for i in range(n):
+		strokes.add(i, 0, (0., 0., 0., 1.), 1.)
+		for j in range(1, m):
+			strokes.add_point(i, j)
+	state = strokes.__getstate__()
+	start = time.time()
+	command = DeleteStrokes(drawings, {0: [n//2]})
+	delete_time = time.time() - start
+	start = time.time()
+	command.undo()
+	undo_time = time.time() - start
+	assert strokes.__getstate__() == state
+	start = time.time()
+	command.redo()
+	redo_time = time.time() - start
+	command.undo()
+	scattered = range(0, n, n//(2*MAX_SPLICES)) # above MAX_SPLICES, rebuilt
+	start = time.time()
+	command = DeleteStrokes(drawings, {0: scattered})
+	command.undo()
+	scattered_time = time.time() - start
+	assert strokes.__getstate__() == state
+	sys.stdout.write("\tmiddle of %d points: deleted in %.1fms, undone in %.1fms, redone in %.1fms "
+	                 "(%d scattered strokes in %.1fms)\n" % (
+		len(strokes.points)//2, delete_time*1000, undo_time*1000, redo_time*1000,
+		len(scattered), scattered_time*1000))
+
+def check_grid():
+	"""strokes deleted after simplification moved their points are not left
+	in the cells of the points moved away"""
+	drawings = defaultdict(Strokes)
+	strokes = drawings[0]
+	strokes.add(100, 30, (0., 0., 0., 1.), 1.) # a short word
+	strokes.add_point(110, 35)
+	underline = strokes.add(0, 0, (0., 0., 0., 1.), 1.) # a fast straight underline
+	for x in range(1, 100):
+		strokes.add_point(5*x, 0, tolerance=.5)
+	command = AddStroke(drawings, 0, underline)
+	command.undo()
+	assert all(underline not in ids for ids in strokes.cells.values())
+	assert strokes.select(((-10, -10), (600, 60))) == [0]
+	command.redo()
+	assert strokes.select(((-10, -10), (600, 60))) == [0, 1]
+
+def main():
+	check_grid()
+	
+	n, m = 1000, 200
+	strokes = Strokes()
+	start = time.time()
+	for i in range(n):
+		strokes.add(i, 0, (0., 0., 0., 1.), 1.)
+		for j in range(1, m):
+			strokes.add_point(i, j)
+	add_time = time.time() - start
+	size = sum(column.itemsize*len(column) for column in [
+		strokes.points, strokes.offsets, strokes.ids, strokes.colors, strokes.widths, strokes.bboxes])
+
+	start = time.time()
+	strokes.transform(range(0, n, 2), (2., 0., 0., 2., 10., 10.))
+	transform_time = time.time() - start
+
+	start = time.time()
+	selected = strokes.select(((0, 0), (n/2, m)))
+	select_time = time.time() - start
+
+	start = time.time()
+	for event in range(100): # dragging the selection
+		strokes.defer(selected, (1., 0., 0., 1., 1., 1.))
+	drag_time = (time.time() - start) / 100
+	start = time.time()
+	strokes.bake()
+	bake_time = time.time() - start
+	
+	start = time.time()
+	strokes.delete(selected)
+	delete_time = time.time() - start
+
+	sys.stdout.write("%d strokes of %d points (%.1fkB): added in %.1fms, "
+	                 "half transformed in %.1fms, %d selected in %.1fms, deleted in %.1fms\n" % (
+		n, m, size/1024,
+		add_time*1000, transform_time*1000,
+		len(selected), select_time*1000, delete_time*1000))
+	sys.stdout.write("\tdragged in %.1fµs per event, baked in %.1fms\n" % (
+		drag_time*1e6, bake_time*1000))
+
+	simplification_benchmark()
+	history_benchmark()
+	export_benchmark()
+
+if __name__ == "__main__":
+	main()
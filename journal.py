@@ -0,0 +1,196 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Append-only journal of the session state, to recover it after a crash
+
+Copyright (c) 2011--2024, IIHM/LIG - Renaud Blanch <http://iihm.imag.fr/blanch/>
+Licence: GPLv3 or higher <http://www.gnu.org/licenses/gpl.html>
+"""
+
+
+# imports ###################################################################
+
+import sys
+import os
+import time
+import zlib
+import queue
+import struct
+import pickle
+import tempfile
+import threading
+
+
+# journal ###################################################################
+
+# the journal is a sequence of frames (length, crc32, pickled (key, value)),
+# the first one holding the key of the document. Records are queued by the
+# caller and written by a thread, which waits SYNC_DELAY after the first
+# record of a batch before writing the batch (only the last record of each
+# key) and syncing it to disk.
+# Replaying keeps the last value of each key, up to the first torn frame, so
+# the thread keeps the last frame of each key too, and rewrites the journal
+# with only those once it grows past COMPACT_RATIO times their size.
+
+FRAME = struct.Struct('<II')
+SYNC_DELAY = .5 # in seconds
+COMPACT_RATIO = 4
+COMPACT_MIN_SIZE = 1<<20 # in bytes, journals below are never compacted
+DOCUMENT = '__document__'
+
+def frame(record):
+	data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+	return FRAME.pack(len(data), zlib.crc32(data)) + data
+
+def replay(path, document_key):
+	"""last value of each key recorded for the document, {} if none"""
+	state = {}
+	try:
+		with open(path, 'rb') as f:
+			data = f.read()
+	except OSError:
+		return state
+	pos = 0
+	while pos + FRAME.size <= len(data):
+		length, crc = FRAME.unpack_from(data, pos)
+		payload = data[pos+FRAME.size:pos+FRAME.size+length]
+		if len(payload) < length or zlib.crc32(payload) != crc:
+			break # torn write
+		try:
+			key, value = pickle.loads(payload)
+		except Exception:
+			break
+		if pos == 0 and (key, value) != (DOCUMENT, document_key):
+			return {}
+		state[key] = value
+		pos += FRAME.size + length
+	state.pop(DOCUMENT, None)
+	return state
+
+
+class Journal(object):
+	"""started with a snapshot of the state (written synchronously, so that
+	the previous journal is only replaced once it is on disk)"""
+	def __init__(self, path, document_key, snapshot=()):
+		self.path = path
+		self.queue = queue.Queue()
+		self.batches = self.records = self.compactions = 0
+		self.frames = {} # key -> last frame written
+		for key, value in [(DOCUMENT, document_key)] + list(snapshot):
+			self.frames[key] = frame((key, value))
+		self.fd = None
+		self.compact()
+		self.thread = threading.Thread(target=self.run, name='journal', daemon=True)
+		self.thread.start()
+
+	def record(self, key, value):
+		"""queue a record, value is pickled later so it should not be mutated"""
+		self.queue.put((key, value))
+
+	def compact(self):
+		"""replace the journal by the last frame of each key (the document
+		key first), only once it is on disk"""
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'wb') as f:
+			f.write(b''.join(self.frames.values()))
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, self.path)
+		if self.fd is not None:
+			os.close(self.fd)
+		self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+		self.size = self.live_size = sum(len(data) for data in self.frames.values())
+
+	def run(self):
+		closing = False
+		while not closing:
+			records = [self.queue.get()]
+			deadline = time.monotonic() + SYNC_DELAY
+			while records[-1] is not None:
+				try:
+					records.append(self.queue.get(timeout=max(0., deadline-time.monotonic())))
+				except queue.Empty:
+					break
+			if records[-1] is None:
+				closing = True
+				records.pop()
+			if not records:
+				continue
+			self.records += len(records)
+			batch = dict(records) # last value of each key
+			frames = [frame(record) for record in batch.items()]
+			for key, data in zip(batch, frames):
+				self.live_size += len(data) - len(self.frames.get(key, b''))
+				self.frames[key] = data
+			data = b''.join(frames)
+			self.size += len(data)
+			if self.size > max(COMPACT_MIN_SIZE, COMPACT_RATIO*self.live_size):
+				self.compact()
+				self.compactions += 1
+			else:
+				os.write(self.fd, data)
+				os.fsync(self.fd)
+			self.batches += 1
+		os.close(self.fd)
+
+	def close(self, remove=False):
+		"""write pending records, and remove the journal (on clean exit)"""
+		self.queue.put(None)
+		self.thread.join()
+		if remove:
+			os.remove(self.path)
+
+	def stats(self):
+		return "%d records in %d batches, %d compactions" % (
+			self.records, self.batches, self.compactions)
+
+
+# benchmark #################################################################
+
+def main():
+	n = 10000
+	with tempfile.TemporaryDirectory() as path:
+		path = os.path.join(path, 'journal')
+		journal = Journal(path, 'document', [('page', 0)])
+		record_time = 0.
+		for i in range(n): # a page turn every 100µs
+			start = time.perf_counter()
+			journal.record('page', i)
+			journal.record(('ink', i % 10), bytes(100))
+			record_time += time.perf_counter() - start
+			time.sleep(1e-4)
+		journal.close()
+		stats = journal.stats()
+
+		with open(path, 'ab') as f: # torn write
+			f.write(frame(('page', -1))[:-1])
+		start = time.perf_counter()
+		state = replay(path, 'document')
+		replay_time = time.perf_counter() - start
+		assert state['page'] == n-1 and len(state) == 11
+		assert replay(path, 'other document') == {}
+	sys.stdout.write("%d records queued in %.1fµs each (%s), replayed in %.1fms\n" % (
+		2*n, record_time/(2*n)*1e6, stats, replay_time*1000))
+	
+	n, page = 80, bytes(800<<10) # a page of ink (100k points) changed by each stroke
+	with tempfile.TemporaryDirectory() as path:
+		path = os.path.join(path, 'journal')
+		journal = Journal(path, 'document')
+		for i in range(n):
+			journal.record(('ink', 0), page + b'%d' % i)
+			if i % 10 == 9:
+				time.sleep(SYNC_DELAY) # a batch every 10 strokes
+		journal.close()
+		size = os.path.getsize(path)
+		start = time.perf_counter()
+		state = replay(path, 'document')
+		replay_time = time.perf_counter() - start
+		assert state[('ink', 0)] == page + b'%d' % (n-1)
+		assert size <= COMPACT_RATIO*len(frame((('ink', 0), state[('ink', 0)])))
+	sys.stdout.write("%d large records: %.1fMB journal (%s), replayed in %.1fms\n" % (
+		n, size/(1<<20), journal.stats(), replay_time*1000))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,435 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Single pass scanning of pdf pages for presentation related structures
+
+Copyright (c) 2011--2024, IIHM/LIG - Renaud Blanch <http://iihm.imag.fr/blanch/>
+Licence: GPLv3 or higher <http://www.gnu.org/licenses/gpl.html>
+"""
+
+
+# imports ###################################################################
+
+import sys
+import os
+import time
+import pickle
+import hashlib
+import pathlib
+import functools
+import queue
+import tempfile
+import threading
+import subprocess
+
+from collections import defaultdict
+
+import pdfreader
+
+
+# handlers ##################################################################
+
+class Handlers(object):
+	"""named handlers called in turn on a page, with their running time
+	accumulated and their failures logged"""
+	def __init__(self, log=None):
+		self.handlers = []
+		self.timings = defaultdict(float)
+		self.failures = defaultdict(int)
+		self.log = log or (lambda message: sys.stderr.write(message + '\n'))
+
+	def register(self, name, handler):
+		self.handlers.append((name, handler))
+
+	def __call__(self, page_number, *args):
+		for name, handler in self.handlers:
+			start = time.perf_counter()
+			try:
+				handler(page_number, *args)
+			except Exception as e: # a broken annotation should not stop the scan
+				self.failures[name] += 1
+				self.log('%s failed on page %d: %s: %s' % (name, page_number+1, type(e).__name__, e))
+			self.timings[name] += time.perf_counter() - start
+
+	def report(self):
+		return ', '.join(
+			'%s: %.1fms%s' % (name, t*1000,
+				' (%d failures)' % self.failures[name] if self.failures[name] else '')
+			for name, t in sorted(self.timings.items(), key=lambda item: -item[1])
+		)
+
+
+# page scanner ##############################################################
+
+# each page dictionary and its annotations are fetched once, then handed
+# to every registered handler which stores compact (picklable) results:
+# 'duration': float,
+# 'movies':   [(((x, y), (w, h)), url)],
+# 'scripts':  [javascript source],
+# 'notes':    [text],
+
+class PageScanner(Handlers):
+	def __init__(self, document, media_path, log=None):
+		super(PageScanner, self).__init__(log)
+		self.document = document
+		self.media_path = media_path # where embedded movies are extracted
+		for name, handler in HANDLERS:
+			self.register(name, functools.partial(handler, self))
+
+	def scan(self, page_number):
+		start = time.perf_counter()
+		get = self.document.get
+		page = self.document.page(page_number)
+		annotations = []
+		try:
+			for annotation in self.document.get_list(page, 'Annots'):
+				try:
+					annotations.append((get(annotation, 'Subtype'), annotation))
+				except LookupError:
+					continue
+		except LookupError:
+			pass
+		self.timings['pages'] += time.perf_counter() - start
+
+		result = {}
+		self(page_number, page, annotations, result)
+		return result
+
+
+def scan_duration(scanner, page_number, page, annotations, result):
+	try:
+		result['duration'] = scanner.document.get(page, 'Dur')
+	except LookupError:
+		pass
+
+
+def movie_url(scanner, movie):
+	"""return the url of a movie given as a file specification"""
+	get = scanner.document.get
+	if isinstance(movie, dict):
+		try:
+			get(movie, 'FS')
+		except LookupError:
+			path = os.path.join(scanner.media_path, os.path.basename(get(movie, 'F')))
+			partial_path = '%s.%d' % (path, os.getpid()) # workers may share movies
+			with open(partial_path, 'bw') as movie_file:
+				movie_file.write(get(movie, 'EF', 'F'))
+			os.replace(partial_path, path)
+		else:
+			return get(movie, 'F')
+	else:
+		path = os.path.join(os.path.dirname(scanner.document.path), movie)
+	return pathlib.Path(os.path.abspath(path)).as_uri()
+
+def annotation_movie(scanner, subtype, annotation):
+	"""bounds and url of the movie played by annotation, None if it plays none"""
+	get = scanner.document.get
+	if subtype == 'Movie':
+		movie = get(annotation, 'Movie', 'F')
+
+	elif subtype in ['Screen', 'Widget']: # movie15 style embedded movie?
+		po = get(annotation, 'AA', 'PO') # LookupError when it plays nothing
+		if get(po, 'S') != 'Rendition': return None
+		if get(po, 'R', 'S') != 'MR': return None
+		if get(po, 'R', 'C', 'S') != 'MCD': return None
+		movie = get(po, 'R', 'C', 'D')
+
+	elif subtype == 'RichMedia': # media9 style embedded movie?
+		content = get(annotation, 'RichMediaContent')
+		try:
+			params = get(content, 'Configurations', 0, 'Instances', 0, 'Params', 'FlashVars')
+			params = dict(
+				param.split('=')
+				for param in params.split('&') if param
+			)
+			source = params['source']
+		except LookupError:
+			source = None
+		assets = iter(scanner.document.get_list(content, 'Assets', 'Names'))
+		for asset_name in assets:
+			movie = next(assets)
+			if asset_name == source:
+				break
+
+	else:
+		return None
+
+	x0, y0, x1, y1 = scanner.document.get_list(annotation, 'Rect')
+	return ((x0, y0), (x1-x0, y1-y0)), movie_url(scanner, movie)
+
+def scan_movies(scanner, page_number, page, annotations, result):
+	for subtype, annotation in annotations:
+		try: # a broken annotation should not hide the other movies of the page
+			movie = annotation_movie(scanner, subtype, annotation)
+		except LookupError:
+			continue
+		if movie is not None:
+			result.setdefault('movies', []).append(movie)
+
+
+def scan_scripts(scanner, page_number, page, annotations, result):
+	"""collect page open javascript (used by the animate package)"""
+	get = scanner.document.get
+	for subtype, annotation in annotations:
+		if subtype not in ['Screen', 'Widget']:
+			continue
+		try:
+			po = get(annotation, 'AA', 'PO')
+			if get(po, 'S') != 'JavaScript':
+				continue
+			script = get(po, 'JS')
+		except LookupError:
+			continue
+		if isinstance(script, bytes):
+			script = script.decode('utf-8', 'replace')
+		result.setdefault('scripts', []).append(script)
+
+
+def scan_notes(scanner, page_number, page, annotations, result):
+	get = scanner.document.get
+	for subtype, annotation in annotations:
+		if subtype != 'Text':
+			continue
+		try:
+			note = get(annotation, 'Contents')
+		except LookupError:
+			note = ''
+		result.setdefault('notes', []).append(note.replace('\r', '\n'))
+
+
+HANDLERS = [
+	('durations',  scan_duration),
+	('movies',     scan_movies),
+	('animations', scan_scripts),
+	('notes',      scan_notes),
+]
+
+
+# page content hash #########################################################
+
+# the digest covers what a page looks like: its geometry and resources (as
+# inherited from the page tree), its content streams and the appearance of
+# its annotations, walked down to the fonts and nested xobjects. Back links
+# and embedded files (that do not change the looks) are not followed.
+
+PAGE_INHERITED = ['MediaBox', 'CropBox', 'Rotate', 'Resources']
+ANNOTATION_LOOKS = ['Subtype', 'Rect', 'F', 'AP', 'AS', 'C', 'IC', 'CA', 'BS', 'Border',
+                    'BE', 'DA', 'Q', 'MK', 'Contents', 'QuadPoints', 'InkList', 'L', 'Vertices']
+HASH_SKIPPED = {'Parent', 'P', 'Metadata', 'PieceInfo', 'EF', 'Thumb'}
+
+def hash_object(document, h, obj, seen):
+	"""feed h with obj and the objects it refers to (once each)"""
+	stack = [obj]
+	while stack:
+		obj = stack.pop()
+		if isinstance(obj, pdfreader.Ref):
+			if obj in seen:
+				h.update(b'R%d' % obj.number)
+				continue
+			seen.add(obj)
+			obj = document.resolve(obj)
+		if isinstance(obj, pdfreader.Stream):
+			h.update(obj.raw())
+			obj = obj.dict
+		if isinstance(obj, dict):
+			h.update(b'<<%d' % len(obj))
+			for key in sorted(obj, reverse=True):
+				if key not in HASH_SKIPPED:
+					stack.append(obj[key])
+					stack.append(key)
+		elif isinstance(obj, list):
+			h.update(b'[%d' % len(obj))
+			stack.extend(reversed(obj))
+		else:
+			h.update(repr(obj).encode())
+
+def page_hash(document, page_number):
+	"""digest of the looks of the page"""
+	h = hashlib.blake2b(digest_size=16)
+	seen = set()
+	page = document.page(page_number)
+	inherited, node, nodes = {}, page, set()
+	while isinstance(node, dict) and id(node) not in nodes: # up the page tree
+		nodes.add(id(node))
+		for key in PAGE_INHERITED:
+			if key in node:
+				inherited.setdefault(key, node[key])
+		node = document.resolve(node.get('Parent'))
+	for key in PAGE_INHERITED:
+		hash_object(document, h, inherited.get(key), seen)
+	hash_object(document, h, page.get('Contents'), seen)
+	annotations = document.resolve(page.get('Annots'))
+	for annotation in annotations if isinstance(annotations, list) else []:
+		annotation = document.resolve(annotation)
+		if isinstance(annotation, dict):
+			hash_object(document, h, [annotation.get(key) for key in ANNOTATION_LOOKS], seen)
+	return h.digest()
+
+
+# parallel scanning #########################################################
+
+# pages are sharded in one contiguous slice per worker process, running this
+# module (so that the calling script is not imported again, as
+# multiprocessing would do) with the document opened once, which streams
+# back each page result (pickled) as soon as it is scanned, then its timings.
+# each worker costs an interpreter start and a document parse, so the scan
+# is only parallel when asked for (see the benchmark for the break even).
+
+def scan_slice(path, media_path, first, last, out):
+	"""scan pages in [first, last), dump (page_number, result) pairs to out
+	as they come, then (None, (timings, failures))"""
+	document = pdfreader.Document(path)
+	scanner = PageScanner(document, media_path)
+	for page_number in range(first, last):
+		try:
+			result = scanner.scan(page_number)
+		except LookupError: # left out, as in a serial scan
+			continue
+		pickle.dump((page_number, result), out, pickle.HIGHEST_PROTOCOL)
+		out.flush()
+	document.close()
+	pickle.dump((None, (dict(scanner.timings), dict(scanner.failures))), out)
+	out.flush()
+
+def run_worker(path, media_path, first, last, results):
+	"""put the results streamed by a worker in the results queue, then None"""
+	command = [sys.executable, os.path.abspath(__file__), '--worker',
+	           path, media_path, str(first), str(last)]
+	try:
+		with subprocess.Popen(command, stdout=subprocess.PIPE) as worker:
+			while True:
+				results.put(pickle.load(worker.stdout))
+	except (EOFError, OSError, pickle.UnpicklingError):
+		pass
+	finally:
+		results.put(None)
+
+def scan_parallel(scanner, workers):
+	"""yield (page_number, result) for the pages of the scanner document, as
+	the workers scan them, timings are merged into scanner"""
+	page_count = scanner.document.page_count
+	step = max(1, -(-page_count // workers))
+	results = queue.Queue()
+	threads = [
+		threading.Thread(target=run_worker, args=(
+			scanner.document.path, scanner.media_path, first, min(first+step, page_count), results),
+			daemon=True)
+		for first in range(0, page_count, step)
+	]
+	for thread in threads:
+		thread.start()
+	running = len(threads)
+	while running:
+		item = results.get()
+		if item is None:
+			running -= 1
+			continue
+		page_number, result = item
+		if page_number is not None:
+			yield page_number, result
+			continue
+		timings, failures = result
+		for name, t in timings.items():
+			scanner.timings[name] += t
+		for name, count in failures.items():
+			scanner.failures[name] += count
+
+
+# page labels ###############################################################
+
+def roman(n):
+	result = ''
+	for value, letters in [
+		(1000, 'm'), (900, 'cm'), (500, 'd'), (400, 'cd'),
+		( 100, 'c'), ( 90, 'xc'), ( 50, 'l'), ( 40, 'xl'),
+		(  10, 'x'), (  9, 'ix'), (  5, 'v'), (  4, 'iv'),
+		(   1, 'i'),
+	]:
+		count, n = divmod(n, value)
+		result += letters * count
+	return result
+
+def letters(n):
+	return chr(ord('a') + (n-1) % 26) * ((n-1) // 26 + 1)
+
+NUMBERING = {
+	'D': str,
+	'R': lambda n: roman(n).upper(),
+	'r': roman,
+	'A': lambda n: letters(n).upper(),
+	'a': letters,
+}
+
+def page_labels(document):
+	"""return the labels of all pages, as read from the /PageLabels number tree"""
+	get = document.get
+	page_count = document.page_count
+	ranges = []
+	try:
+		nodes = [get(document.catalog, 'PageLabels')]
+	except LookupError:
+		nodes = []
+	while nodes:
+		node = nodes.pop()
+		if 'Nums' in node:
+			nums = get(node, 'Nums')
+			ranges.extend(zip(nums[0::2], (document.resolve(n) for n in nums[1::2])))
+		if 'Kids' in node:
+			nodes.extend(get(node, 'Kids', i) for i in range(len(get(node, 'Kids'))))
+	ranges.sort(key=lambda r: r[0])
+
+	labels = [str(i+1) for i in range(page_count)]
+	for i, (first, style) in enumerate(ranges):
+		last = ranges[i+1][0] if i+1 < len(ranges) else page_count
+		prefix = get(style, 'P') if 'P' in style else ''
+		numbering = NUMBERING.get(get(style, 'S') if 'S' in style else None)
+		start = get(style, 'St') if 'St' in style else 1
+		for page_number in range(first, min(last, page_count)):
+			n = start + page_number - first
+			labels[page_number] = prefix + (numbering(n) if numbering else '')
+	return labels
+
+
+# benchmark #################################################################
+
+def main(paths):
+	worker_counts = [1]
+	while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+		worker_counts.append(worker_counts[-1] * 2)
+	for path in paths:
+		document = pdfreader.Document(path)
+		with tempfile.TemporaryDirectory() as media_path:
+			scanner = PageScanner(document, media_path)
+			start = time.time()
+			serial = {}
+			for page_number in range(document.page_count):
+				try:
+					serial[page_number] = scanner.scan(page_number)
+				except LookupError:
+					continue
+			serial_time = time.time() - start
+			sys.stdout.write("%s: %d pages scanned in %.1fms (%s)\n" % (
+				path, document.page_count, serial_time*1000, scanner.report()))
+			
+			start = time.time()
+			for page_number in range(document.page_count):
+				page_hash(document, page_number)
+			sys.stdout.write("\tpages hashed in %.1fms\n" % ((time.time()-start)*1000))
+			
+			for workers in worker_counts:
+				start = time.time()
+				parallel = dict(scan_parallel(PageScanner(document, media_path), workers))
+				parallel_time = time.time() - start
+				assert parallel == serial, "parallel scan differs from serial scan"
+				sys.stdout.write("\t%2d workers: %.1fms (x%.2f)\n" % (
+					workers, parallel_time*1000, serial_time/parallel_time))
+		document.close()
+
+if __name__ == "__main__":
+	if sys.argv[1:2] == ['--worker']:
+		path, media_path, first, last = sys.argv[2:]
+		scan_slice(path, media_path, int(first), int(last), sys.stdout.buffer)
+	else:
+		main(sys.argv[1:])
@@ -0,0 +1,203 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Incremental updates of pdf files: new and changed objects appended after the
+original bytes, with a cross reference section chained to the previous one
+
+Copyright (c) 2011--2024, IIHM/LIG - Renaud Blanch <http://iihm.imag.fr/blanch/>
+Licence: GPLv3 or higher <http://www.gnu.org/licenses/gpl.html>
+"""
+
+
+# imports ###################################################################
+
+import sys
+import os
+import re
+import time
+import tempfile
+
+from collections import namedtuple
+
+import pdfreader
+from pdfreader import PDFError, Ref
+
+
+# objects ###################################################################
+
+# python objects are written back as pdf objects, using the mapping of
+# pdfreader, with new streams given as NewStream (pdfreader.Stream are copied)
+# and already serialized objects (e.g. long arrays of numbers) as Raw
+
+NewStream = namedtuple('NewStream', ['dict', 'data'])
+
+class Raw(bytes):
+	pass
+
+_irregular = re.compile(rb'[^!-~]|[()<>\[\]{}/%#]')
+_string_special = re.compile(rb'[()\\\r]')
+
+def serialize(obj):
+	if obj is None:
+		return b'null'
+	if obj is True:
+		return b'true'
+	if obj is False:
+		return b'false'
+	if isinstance(obj, int):
+		return b'%d' % obj
+	if isinstance(obj, float):
+		return (b'%.4f' % obj).rstrip(b'0').rstrip(b'.') or b'0'
+	if isinstance(obj, str):
+		return b'/' + _irregular.sub(lambda m: b'#%02x' % m.group(0)[0], obj.encode('utf-8'))
+	if isinstance(obj, Raw):
+		return obj
+	if isinstance(obj, bytes):
+		return b'(' + _string_special.sub(lambda m: b'\\' + (b'r' if m.group(0) == b'\r' else m.group(0)), obj) + b')'
+	if isinstance(obj, Ref):
+		return b'%d %d R' % obj
+	if isinstance(obj, list):
+		return b'[' + b' '.join(serialize(item) for item in obj) + b']'
+	if isinstance(obj, dict):
+		return b'<<' + b''.join(serialize(key) + b' ' + serialize(value)
+		                        for key, value in obj.items()) + b'>>'
+	if isinstance(obj, pdfreader.Stream):
+		obj = NewStream(obj.dict, obj.raw())
+	if isinstance(obj, NewStream):
+		d = dict(obj.dict)
+		d['Length'] = len(obj.data)
+		return serialize(d) + b'\nstream\n' + obj.data + b'\nendstream'
+	raise TypeError('can not write %r in a pdf' % (obj,))
+
+
+# incremental update ########################################################
+
+class IncrementalUpdate(object):
+	"""objects written one at a time at the end of out (a binary file opened
+	for appending to a copy of the document file), the cross reference section
+	and trailer being written on close"""
+	def __init__(self, document, out):
+		if document.startxref is None:
+			raise PDFError('can not update a damaged file')
+		if document.security is not None: # objects would have to be encrypted
+			raise PDFError('can not update an encrypted file')
+		self.document = document
+		self.out = out
+		self.offset = out.seek(0, os.SEEK_END)
+		self.size = document.trailer['Size']
+		self.offsets = {} # number -> offset of the objects written
+		self.write_raw(b'\n')
+
+	def write_raw(self, data):
+		self.out.write(data)
+		self.offset += len(data)
+
+	def new_ref(self):
+		ref = Ref(self.size, 0)
+		self.size += 1
+		return ref
+
+	def write(self, ref, obj):
+		"""write obj as the (new or replaced) object ref"""
+		self.offsets[ref.number] = self.offset
+		self.write_raw(b'%d %d obj\n' % ref + serialize(obj) + b'\nendobj\n')
+
+	def sections(self):
+		"""runs of consecutive object numbers written"""
+		numbers = sorted(self.offsets)
+		start = 0
+		for i in range(1, len(numbers)+1):
+			if i == len(numbers) or numbers[i] != numbers[i-1]+1:
+				yield numbers[start:i]
+				start = i
+
+	def close(self):
+		trailer = {
+			'Size': self.size,
+			'Root': self.document.trailer['Root'],
+			'Prev': self.document.startxref,
+		}
+		for key in ['Info', 'ID']:
+			if key in self.document.trailer:
+				trailer[key] = self.document.trailer[key]
+		xref_offset = self.offset
+		if self.document.trailer.get('Type') == 'XRef':
+			# a file with xref streams is updated with an xref stream
+			ref = self.new_ref()
+			self.offsets[ref.number] = xref_offset
+			trailer['Size'] = self.size
+			index, data = [], bytearray()
+			for numbers in self.sections():
+				index.extend([numbers[0], len(numbers)])
+				for number in numbers:
+					data += b'\x01' + self.offsets[number].to_bytes(5, 'big') + b'\x00'
+			trailer.update({'Type': 'XRef', 'W': [1, 5, 1], 'Index': index})
+			self.write_raw(b'%d %d obj\n' % ref +
+			               serialize(NewStream(trailer, bytes(data))) + b'\nendobj\n')
+		else:
+			self.write_raw(b'xref\n')
+			for numbers in self.sections():
+				self.write_raw(b'%d %d\n' % (numbers[0], len(numbers)))
+				self.write_raw(b''.join(b'%010d 00000 n\r\n' % self.offsets[number]
+				                        for number in numbers))
+			self.write_raw(b'trailer\n' + serialize(trailer) + b'\n')
+		self.write_raw(b'startxref\n%d\n%%%%EOF\n' % xref_offset)
+		self.out.flush()
+
+
+# benchmark #################################################################
+
+def sample_document(path, page_count):
+	"""write a minimal pdf with page_count empty pages"""
+	objects = [
+		{'Type': 'Catalog', 'Pages': Ref(2, 0)},
+		{'Type': 'Pages', 'Count': page_count,
+		 'Kids': [Ref(3+i, 0) for i in range(page_count)]},
+	] + [
+		{'Type': 'Page', 'Parent': Ref(2, 0), 'MediaBox': [0, 0, 640, 480]}
+		for _ in range(page_count)
+	]
+	with open(path, 'wb') as f:
+		f.write(b'%PDF-1.7\n')
+		offsets = []
+		for number, obj in enumerate(objects, 1):
+			offsets.append(f.tell())
+			f.write(b'%d 0 obj\n' % number + serialize(obj) + b'\nendobj\n')
+		xref = f.tell()
+		f.write(b'xref\n0 %d\n0000000000 65535 f\r\n' % (len(objects)+1))
+		f.write(b''.join(b'%010d 00000 n\r\n' % offset for offset in offsets))
+		f.write(b'trailer\n' + serialize({'Size': len(objects)+1, 'Root': Ref(1, 0)}))
+		f.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+def main():
+	page_count = 500
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'sample.pdf')
+		sample_document(path, page_count)
+		with open(path, 'rb') as f:
+			original = f.read()
+		document = pdfreader.Document(path)
+		start = time.time()
+		with open(path, 'ab') as out:
+			update = IncrementalUpdate(document, out)
+			for ref, page in zip(document.page_refs(), document.pages()):
+				page = dict(page)
+				page['Rotate'] = 0
+				update.write(ref, page)
+			update.close()
+		update_time = time.time() - start
+		document.close()
+
+		with open(path, 'rb') as f:
+			assert f.read(len(original)) == original, "original bytes rewritten"
+		document = pdfreader.Document(path)
+		assert document.page_count == page_count
+		assert all(document.get(page, 'Rotate') == 0 for page in document.pages())
+		document.close()
+		sys.stdout.write("%d pages updated in %.1fms (%d bytes appended)\n" % (
+			page_count, update_time*1000, os.path.getsize(path) - len(original)))
+
+if __name__ == "__main__":
+	main()
@@ -19,10 +19,20 @@ import getopt
 import textwrap
 import mimetypes
 import base64
-import tempfile
+import hashlib
+import pickle
+import shutil
+import threading
 
 from math import exp, hypot
-from collections import defaultdict
+from collections import defaultdict, namedtuple, deque
+
+import pdfreader
+import pdfscan
+import caches
+import indexes
+import ink
+import journal
 
 
 # constants and helpers #####################################################
@@ -72,7 +82,11 @@ HELP = [
 	(          "l", "toggle pointer/laser/spotlight"),
 	(        "p/P", "reduce/augment pointer/laser/spotlight size"),
 	(          "e", "erase on-screen annotations"),
+	(          "E", "export on-screen annotations to a pdf copy"),
+	(     "⌘z/⇧⌘z", "undo/redo annotations and zoom changes"),
 	(          "x", "switch screens"),
+	(          "o", "show one miniature per frame/page"),
+	(          "g", "goto page label (typed then ⏎)"),
 ]
 
 def nop(): pass
@@ -90,13 +104,14 @@ if launched_from_finder and args and args[0].startswith("-psn"):
 
 def exit_usage(message=None, code=0):
 	usage = textwrap.dedent("""\
-	Usage: %s [-hvip:d:] <doc.pdf>
+	Usage: %s [-hvip:d:yj:] <doc.pdf>
 		-h --help          print this help message then exit
 		-v --version       print version then exit
 		-i --icon          print icon then exit
 		-p --page <p>      start on page int(p)
 		-d --duration <t>  duration of the talk in minutes
 		-y --youtube       do not use invidious instance
+		-j --jobs <n>      scan pages with int(n) worker processes
 		<doc.pdf>          file to present
 	""" % name)
 	if message:
@@ -129,15 +144,16 @@ def exit_icon():
 # options
 
 try:
-	options, args = getopt.getopt(args, "hvip:d:y", ["help", "version", "icon",
-	                                                 "page=", "duration=",
-	                                                 "youtube"])
+	options, args = getopt.getopt(args, "hvip:d:yj:", ["help", "version", "icon",
+	                                                   "page=", "duration=",
+	                                                   "youtube", "jobs="])
 except getopt.GetoptError as message:
 	exit_usage(message, 1)
 
 start_page = None
 presentation_duration = 0
 use_youtube = False
+scan_jobs = 1 # worker processes are opt-in, they seldom pay off
 
 for opt, value in options:
 	if opt in ["-h", "--help"]:
@@ -152,6 +168,8 @@ for opt, value in options:
 		presentation_duration = int(value)
 	elif opt in ['-y', '--youtube']:
 		use_youtube = True
+	elif opt in ['-j', '--jobs']:
+		scan_jobs = int(value)
 
 if len(args) > 1:
 	exit_usage("no more than one argument is expected", 1)
@@ -182,12 +200,13 @@ except ImportError:
 	
 setVerbose(1)
 
-from objc import nil, NO, YES
+from objc import nil, NO, YES, autorelease_pool
 
 from Foundation import (
 	NSLog, NSNotificationCenter, NSUserDefaults, NSAffineTransform,
 	NSObject, NSTimer, NSError, NSString, NSData, NSArray,
 	NSAttributedString, NSUnicodeStringEncoding,
+	NSThread, NSDefaultRunLoopMode,
 	NSURL, NSURLRequest, NSURLConnection,
 	NSURLRequestReloadIgnoringLocalCacheData,
 	NSKeyValueObservingOptionOld, NSKeyValueObservingOptionNew,
@@ -215,9 +234,10 @@ from AppKit import (
 	NSGraphicsContext, NSZeroPoint,
 	NSCompositingOperationClear, NSCompositingOperationSourceAtop,
 	NSCompositingOperationCopy, NSCompositingOperationExclusion,
-	NSCompositingOperationDarken,
-	NSRectFillUsingOperation, NSFrameRectWithWidth, NSFrameRect, NSEraseRect,
-	NSRect, NSZeroRect, NSUnionRect, NSContainsRect, NSPointInRect,
+	NSCompositingOperationDarken, NSCompositingOperationSourceOver,
+	NSCompositingOperationDestinationOver,
+	NSRectFill, NSRectFillUsingOperation, NSFrameRectWithWidth, NSFrameRect, NSEraseRect,
+	NSRect, NSZeroRect, NSUnionRect, NSPointInRect, NSInsetRect,
 	NSColor, NSGradient, NSColorSpace,
 	NSFont, NSFontAttributeName, NSForegroundColorAttributeName,
 	NSStrokeColorAttributeName, NSStrokeWidthAttributeName,
@@ -228,23 +248,20 @@ from AppKit import (
 	NSPageUpFunctionKey, NSPageDownFunctionKey,
 	NSPrevFunctionKey, NSNextFunctionKey, NSF5FunctionKey,
 	NSScreen, NSWorkspace, NSImage, NSBezierPath,
+	NSBitmapImageRep, NSDeviceRGBColorSpace,
 	NSImageNameSlideshowTemplate, NSImageNameEnterFullScreenTemplate,
 	NSRoundLineCapStyle, NSRoundLineJoinStyle, NSEvenOddWindingRule,
 	NSLayoutConstraint,
-	NSEventTypeApplicationDefined, NSEventSubtypeTabletPoint,
+	NSEventSubtypeTabletPoint,
 	NSColorPanelModeCrayon,
 )
 
 from Quartz import (
 	CGShieldingWindowLevel,
-	CGPDFDocumentCreateWithURL,
-	CGPDFDocumentGetNumberOfPages, CGPDFDocumentGetPage, CGPDFPageGetDictionary,
-	CGPDFDictionaryApplyFunction,
-	CGPDFDictionaryRef, CGPDFArrayRef, CGPDFStreamRef, CGPDFStringRef,
-	CGPDFDictionaryGetObject, CGPDFArrayGetCount, CGPDFArrayGetObject,
-	CGPDFObjectGetType, CGPDFObjectGetValue,
-	CGPDFStreamGetDictionary, CGPDFStreamCopyData, CGPDFDataFormatRaw,
-	CGPDFStringCopyTextString,
+	CGColorSpaceCreateDeviceRGB, CGBitmapContextCreate, CGBitmapContextCreateImage,
+	CGImageCreate, CGImageGetDataProvider, CGDataProviderCopyData,
+	CGDataProviderCreateWithCFData, CGContextDrawImage, CGImageGetWidth, CGImageGetHeight,
+	kCGImageAlphaPremultipliedLast, kCGRenderingIntentDefault,
 	PDFDocument, PDFAnnotation, PDFActionNamed,
 	kPDFActionNamedNextPage, kPDFActionNamedPreviousPage,
 	kPDFActionNamedFirstPage, kPDFActionNamedLastPage,
@@ -371,79 +388,90 @@ if not pdf:
 	exit_usage("'%s' does not seem to be a pdf." % url.path(), 1)
 
 
-# tmp dir for embedded movies
+# metadata cache ############################################################
 
-TMP_DIR_PATH = tempfile.mkdtemp(prefix='%s-' % ID)
-def cleanup_tmp():
-	for p in os.listdir(TMP_DIR_PATH):
-		os.remove(os.path.join(TMP_DIR_PATH, p))
-	os.rmdir(TMP_DIR_PATH)
+# the structure of a document is cached across launches, keyed by its path,
+# size, mtime and a hash of its head and tail (where pdf writers put the
+# trailer, xref and /ID that change with any edit).
+# embedded movies are extracted next to the cached metadata.
 
+CACHE_VERSION = 2
+CACHE_HASH_SIZE = 1<<16
+CACHE_DIR_PATH = os.path.join(os.path.expanduser('~/Library/Caches'), ID)
+CACHE_STATS = '.'.join([ID, 'cache_stats'])
 
-# structure #################################################################
+def document_key(path):
+	stat = os.stat(path)
+	h = hashlib.blake2b(digest_size=16)
+	with open(path, 'rb') as f:
+		h.update(f.read(CACHE_HASH_SIZE))
+		f.seek(max(0, stat.st_size-CACHE_HASH_SIZE))
+		h.update(f.read())
+	return CACHE_VERSION, str(path), stat.st_size, stat.st_mtime, h.hexdigest()
 
-# we'll need to look for info only available with low level CGPDF API
+_document_key = document_key(url.path())
+CACHE_PATH = os.path.join(CACHE_DIR_PATH,
+	hashlib.blake2b(url.path().encode(), digest_size=8).hexdigest())
+METADATA_PATH = os.path.join(CACHE_PATH, 'metadata')
+ATLAS_PATH = os.path.join(CACHE_PATH, 'thumbnails')
+JOURNAL_PATH = os.path.join(CACHE_PATH, 'journal')
 
-_pdf = CGPDFDocumentCreateWithURL(url)
-_page_count = CGPDFDocumentGetNumberOfPages(_pdf)
+def load_metadata():
+	try:
+		with open(METADATA_PATH, 'rb') as f:
+			if pickle.load(f) != _document_key:
+				return None
+			return pickle.load(f)
+	except Exception:
+		return None
+
+def save_metadata(metadata):
+	tmp_path = METADATA_PATH + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		pickle.dump(_document_key, f, pickle.HIGHEST_PROTOCOL)
+		pickle.dump(metadata, f, pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_path, METADATA_PATH)
+
+metadata = load_metadata()
+if metadata is None: # stale embedded movies, the thumbnails atlas is patched instead
+	os.makedirs(CACHE_PATH, exist_ok=True)
+	for name in os.listdir(CACHE_PATH):
+		path = os.path.join(CACHE_PATH, name)
+		if path in [ATLAS_PATH, JOURNAL_PATH]: # the journal checks the document itself
+			continue
+		if os.path.isdir(path):
+			shutil.rmtree(path)
+		else:
+			os.remove(path)
 
-def cgpdf_dictionary2dict(d):
-	res = {}
-	CGPDFDictionaryApplyFunction(d, lambda k, v, _: res.update({k: v}), None)
-	return res
+cache_stats = user_defaults.dictionaryForKey_(CACHE_STATS)
+cache_stats = {'hits': 0, 'misses': 0} if cache_stats is None else dict(cache_stats)
+cache_stats['misses' if metadata is None else 'hits'] += 1
+user_defaults.setObject_forKey_(cache_stats, CACHE_STATS)
+NSLog("metadata cache %@ for %@ (%d hits, %d misses)",
+	'miss' if metadata is None else 'hit', url.path(),
+	cache_stats['hits'], cache_stats['misses'])
 
-def cgpdf_array2list(a):
-	return list(
-		cgpdf_get(a, i)
-		for i in range(CGPDFArrayGetCount(a))
-	)
+# a journal left behind means that the last session did not end cleanly
+recovered = journal.replay(JOURNAL_PATH, _document_key)
+if recovered:
+	NSLog("recovering %d journaled states for %@", len(recovered), url.path())
 
-def cgpdf_stream2str(s):
-	data, fmt = CGPDFStreamCopyData(s, None)
-	if fmt != CGPDFDataFormatRaw:
-		raise TypeError('unsupported data format: %s' % fmt)
-	return data
 
-def cgpdf_get(data, *path):
-	"""walk the pdf dict/array structure"""
-	try:
-		head, *path = path
-	except:
-		formatter = {
-#			CGPDFDictionaryRef: cgpdf_dictionary2dict,
-#			CGPDFArrayRef:      cgpdf_array2list,
-			CGPDFStreamRef:	    cgpdf_stream2str,
-			CGPDFStringRef:     CGPDFStringCopyTextString,
-		}.get(data.__class__, lambda d: d)
-		return formatter(data)
-	getter = {
-		CGPDFDictionaryRef: CGPDFDictionaryGetObject,
-		CGPDFArrayRef:      CGPDFArrayGetObject,
-		CGPDFStreamRef:     lambda s, k, _: CGPDFDictionaryGetObject(CGPDFStreamGetDictionary(s), k, _),
-	}[data.__class__]
-	try:
-		head = head.encode()
-	except:
-		pass
-	ok, o = getter(data, head, None)
-	if not ok:
-		raise LookupError('wrong key %s in %s' % (head, data))
-	ok, value = CGPDFObjectGetValue(o, CGPDFObjectGetType(o), None)
-	if not ok:
-		raise TypeError('unable to cast %s into %s' % (o, CGPDFObjectGetType(o)))
-	return cgpdf_get(value, *path)
+# structure #################################################################
+
+# we'll need to look for info only available at the pdf object level
+
+try:
+	_pdf = pdfreader.Document(url.path())
+except (OSError, pdfreader.PDFError) as e:
+	NSLog("unable to read pdf structure: %@", str(e))
+	_pdf = None
 
 
 # durations of pages
 
-durations = {}
-for page_number in range(_page_count):
-	_page = CGPDFDocumentGetPage(_pdf, page_number+1)
-	_dict = CGPDFPageGetDictionary(_page)
-	try:
-		durations[page_number] = cgpdf_get(_dict, 'Dur')
-	except LookupError:
-		pass
+durations = {} # filled by scan_structure
 
 class PageTurner(NSObject):
 	def turn_(self, timer):
@@ -483,7 +511,9 @@ def toggle_auto_turn(auto_turn=None):
 recent_files = user_defaults.dictionaryForKey_(RECENT_FILES)
 recent_files = {} if recent_files is None else recent_files.mutableCopy()
 if start_page is None:
-	if url.path() in recent_files:
+	if 'page' in recovered:
+		start_page = recovered['page']
+	elif url.path() in recent_files:
 		start_page = recent_files[url.path()]
 	else:
 		start_page = 0
@@ -497,7 +527,10 @@ future_pages = []
 
 def _goto(page):
 	global current_page
+	prefetcher.turned(current_page, page)
 	current_page = page
+	record_page()
+	scanner.prioritize(page)
 	handle_turn(page)
 	presentation_show(slide_view)
 
@@ -530,48 +563,45 @@ def goto_page(page):
 		_goto(page)
 
 
-pages = list(range(page_count)) # pages index
-
-frames = []      # frames index
-frame_pages = [] # list of overlays by page
-current_label = None
-for page_number in range(page_count):
-	page = pdf.pageAtIndex_(page_number)
-	label = page.label()
-	if label != current_label:
-		# a new frame just started
-		frames.append(page_number)
-		current_label = label
-	frame_pages.append(list(range(frames[-1], page_number+1)))
-
-sections = [] # sections index
-outline = pdf.outlineRoot()
-if outline:
-	for i in range(outline.numberOfChildren()):
-		section = outline.childAtIndex_(i)
-		destination = section.destination()
-		sections.append(pdf.indexForPage_(destination.page()))
-
-def _next(index):
-	for page in index:
-		if page > current_page:
-			return page
-	return current_page
-
-def _prev(index):
-	for page in reversed(index):
-		if page < current_page:
-			return page
-	return current_page
+if metadata is not None:
+	labels   = metadata['labels']
+	sections = metadata['sections']
+else:
+	labels = None
+	if _pdf is not None: # without fetching every page
+		try:
+			labels = pdfscan.page_labels(_pdf)
+		except (LookupError, TypeError, ValueError, pdfreader.PDFError):
+			pass
+	if labels is None or len(labels) != page_count: # PDFKit sees other pages
+		labels = [pdf.pageAtIndex_(i).label() for i in range(page_count)]
+	
+	sections = []
+	outline = pdf.outlineRoot()
+	if outline:
+		for i in range(outline.numberOfChildren()):
+			section = outline.childAtIndex_(i)
+			destination = section.destination()
+			sections.append(pdf.indexForPage_(destination.page()))
+
+# frames are consecutive pages sharing a label (i.e., beamer overlays)
+navigation = indexes.Navigation(labels, sections)
+
+def frame_pages(page):
+	"""overlays of the frame of page, up to page"""
+	if page == BOARD:
+		return [BOARD]
+	start, _ = navigation.frame(page)
+	return range(start, page+1)
 
 def home_page():    goto_page(first_page)
 def end_page():     goto_page(last_page)
-def next_page():    goto_page(_next(pages))
-def prev_page():    goto_page(_prev(pages))
-def next_frame():   goto_page(_next(frames))
-def prev_frame():   goto_page(_prev(frames))
-def next_section(): goto_page(_next(sections))
-def prev_section(): goto_page(_prev(sections))
+def next_page():    goto_page(current_page+1)
+def prev_page():    goto_page(current_page-1)
+def next_frame():   goto_page(navigation.next(navigation.starts, current_page))
+def prev_frame():   goto_page(navigation.prev(navigation.starts, current_page))
+def next_section(): goto_page(navigation.next(navigation.sections, current_page))
+def prev_section(): goto_page(navigation.prev(navigation.sections, current_page))
 
 
 # youtube redirection
@@ -605,60 +635,158 @@ def redirect(url):
 
 # movie annotations
 
+# movies are probed a few at a time (each item needs a player to load),
+# the ones not loaded after PROBE_TIMEOUT being given up. Posters are grabbed
+# in worker threads, and movies are delivered on the main thread as they
+# complete, so the presentation is usable while probing.
+# posters are cached across launches (see poster_key), so that only new or
+# changed movies are decoded.
+
+MAX_PROBES = 4 # movies loaded at once
+PROBE_TIMEOUT = 10. # in seconds
+
 player = AVPlayer.playerWithURL_(None)
-nop_event = NSEvent.otherEventWithType_location_modifierFlags_timestamp_windowNumber_context_subtype_data1_data2_(
-	NSEventTypeApplicationDefined, (0, 0), 0, 0., 0, None, 0, 0, 0
-)
+probe_players = [AVPlayer.playerWithURL_(None) for _ in range(MAX_PROBES)] # items load only when attached to a player
+
+movie_probes = deque() # (url, callback) waiting for a probe player
+probes = {} # item being probed -> (probe player, callback)
+
+POSTER_SIZE = 1280 # in pixels, largest side of the cached posters
+POSTERS_PATH = os.path.join(CACHE_DIR_PATH, 'posters') # shared by documents
+posters = caches.Posters(POSTERS_PATH)
+
+def poster_key(path):
+	"""digest of the movie file identity (path, size and mtime), movies
+	extracted from the document being written again only when it changes"""
+	stat = os.stat(path)
+	return hashlib.blake2b(repr((path, stat.st_size, stat.st_mtime_ns)).encode(),
+	                       digest_size=16).digest()
+
+def poster_pixels(image_ref):
+	"""rgba pixels of the image, scaled down to POSTER_SIZE"""
+	width, height = CGImageGetWidth(image_ref), CGImageGetHeight(image_ref)
+	scale = min(1., POSTER_SIZE/max(width, height))
+	width, height = max(1, int(width*scale+.5)), max(1, int(height*scale+.5))
+	context = CGBitmapContextCreate(None, width, height, 8, width*4,
+	                                device_rgb, kCGImageAlphaPremultipliedLast)
+	CGContextDrawImage(context, ((0, 0), (width, height)), image_ref)
+	image = CGBitmapContextCreateImage(context)
+	return width, height, bytes(CGDataProviderCopyData(CGImageGetDataProvider(image)))
+
+def pixels_poster(width, height, pixels):
+	provider = CGDataProviderCreateWithCFData(NSData.dataWithBytes_length_(pixels, len(pixels)))
+	image = CGImageCreate(width, height, 8, 32, width*4,
+	                      device_rgb, kCGImageAlphaPremultipliedLast, provider,
+	                      None, False, kCGRenderingIntentDefault)
+	return NSImage.alloc().initWithCGImage_size_(image, (0, 0))
+
+def grab_poster(item):
+	"""poster of the movie, from the cache or from its first frame"""
+	try:
+		key = poster_key(item.asset().URL().path())
+	except OSError:
+		key = None
+	cached = None if key is None else posters.get(key)
+	if cached is None:
+		image_generator = AVAssetImageGenerator.assetImageGeneratorWithAsset_(item.asset())
+		image_ref = _e(image_generator.copyCGImageAtTime_actualTime_error_(
+			(0, 1, 1, 0), None, None,
+		))
+		cached = poster_pixels(image_ref)
+		if key is not None:
+			try:
+				posters.put(key, *cached)
+			except OSError as e:
+				NSLog("unable to cache poster: %@", str(e))
+	return pixels_poster(*cached)
 
 class PlayerItemObserver(NSObject):
 	def observeValueForKeyPath_ofObject_change_context_(self, keyPath, item, change, context):
 		assert type(item) == AVPlayerItem
 		assert change["new"] != change["old"]
 		assert change["new"] == item.status()
-		item.removeObserver_forKeyPath_(self, "status")
 		
-		self.playable = item.status() == AVPlayerItemStatusReadyToPlay
-		app.stop_(self)
-		app.postEvent_atStart_(nop_event, True) # we are not in event thread
+		# we are not in event thread
+		self.performSelectorOnMainThread_withObject_waitUntilDone_("probed:", item, False)
+	
+	def probed_(self, item):
+		if item not in probes: # timed out
+			return
+		callback = stop_probe(item)
+		if item.status() != AVPlayerItemStatusReadyToPlay:
+			release_probe(item)
+			callback(None)
+			return
+		NSThread.detachNewThreadSelector_toTarget_withObject_("grab:", self, item)
+	
+	def timedOut_(self, item):
+		if item not in probes:
+			return
+		callback = stop_probe(item)
+		release_probe(item)
+		NSLog("movie not loaded after %.0fs: %@", PROBE_TIMEOUT, item.asset().URL())
+		callback(None)
+	
+	def grab_(self, item):
+		with autorelease_pool():
+			try:
+				poster = grab_poster(item)
+			except:
+				poster = None
+			self.performSelectorOnMainThread_withObject_waitUntilDone_("grabbed:", (item, poster), False)
+	
+	def grabbed_(self, result):
+		item, poster = result
+		_, callback = probes[item]
+		release_probe(item)
+		callback((item, poster))
 item_observer = PlayerItemObserver.alloc().init()
 
 
-def get_movie(url):
-	"""return a AVPlayerItem object from an url if possible/desirable"""
+def is_movie(url):
+	"""tell if an url is worth probing for a movie"""
 	if not (url and url.scheme() == "file"):
-		return
+		return False
 	mimetype, _ = mimetypes.guess_type(url.absoluteString())
-	if not (mimetype and any(mimetype.startswith(t) for t in ["video", "audio", "image/gif"])):
-		return
-	
-	global restarted
-	asset = AVAsset.assetWithURL_(url)
-	player_item = AVPlayerItem.playerItemWithAsset_automaticallyLoadedAssetKeys_(
-		asset,
-		["playable",],
-	)
-	player_item.addObserver_forKeyPath_options_context_(
-		item_observer, "status",
-		NSKeyValueObservingOptionOld | NSKeyValueObservingOptionNew,
-		None,
-	)
-	player.replaceCurrentItemWithPlayerItem_(player_item)
-	app.run()
-	restarted = True
-	player.replaceCurrentItemWithPlayerItem_(None)
-	
-	if not item_observer.playable:
-		return
-	
-	image_generator = AVAssetImageGenerator.assetImageGeneratorWithAsset_(asset)
-	try:
-		image_ref = _e(image_generator.copyCGImageAtTime_actualTime_error_(
-			(0, 1, 1, 0), None, None,
-		))
-		poster = NSImage.alloc().initWithCGImage_size_(image_ref, (0, 0))
-	except:
-		poster = None
-	return player_item, poster
+	return bool(mimetype and any(mimetype.startswith(t) for t in ["video", "audio", "image/gif"]))
+
+def probe_movies():
+	"""start probing the waiting movies while probe players are free"""
+	while movie_probes and probe_players:
+		url, callback = movie_probes.popleft()
+		asset = AVAsset.assetWithURL_(url)
+		player_item = AVPlayerItem.playerItemWithAsset_automaticallyLoadedAssetKeys_(
+			asset,
+			["playable",],
+		)
+		probe_player = probe_players.pop()
+		probes[player_item] = probe_player, callback
+		player_item.addObserver_forKeyPath_options_context_(
+			item_observer, "status",
+			NSKeyValueObservingOptionOld | NSKeyValueObservingOptionNew,
+			None,
+		)
+		item_observer.performSelector_withObject_afterDelay_("timedOut:", player_item, PROBE_TIMEOUT)
+		probe_player.replaceCurrentItemWithPlayerItem_(player_item)
+
+def stop_probe(item):
+	"""stop observing item (loaded or timed out), return its callback"""
+	NSObject.cancelPreviousPerformRequestsWithTarget_selector_object_(item_observer, "timedOut:", item)
+	item.removeObserver_forKeyPath_(item_observer, "status")
+	_, callback = probes[item]
+	return callback
+
+def release_probe(item):
+	"""give the probe player of item to the next waiting movie"""
+	probe_player, _ = probes.pop(item)
+	probe_player.replaceCurrentItemWithPlayerItem_(None)
+	probe_players.append(probe_player)
+	probe_movies()
+
+def get_movie(url, callback):
+	"""probe url in the background, then call back with a (AVPlayerItem, poster) pair or None"""
+	movie_probes.append((url, callback))
+	probe_movies()
 
 
 # animations generated with the animate package
@@ -730,8 +858,21 @@ def parse_js(script, page_number):
 	animations_state[a] = (1 if autoplay else 0, fps, loop)
 
 
+display_generations = defaultdict(int) # page number -> changes of the annotations shown
+
+def display_changed(page):
+	"""invalidate the bitmaps of page, annotations were shown or hidden (pages
+	of other documents, e.g. the thumbnailer's, are not rendered)"""
+	if page is not None and page.document() == pdf:
+		display_generations[pdf.indexForPage_(page)] += 1
+
 animations = {}
-def prepare_animations(annotations):
+def hide_animations(annotations):
+	"""hide the animation controls and all frames but the first ones, given
+	the widgets by name, return the frames by animation"""
+	frames_by_animation = {}
+	for page in {annotation.page() for annotation in annotations.values()}:
+		display_changed(page)
 	for k in annotations:
 		if 'PlayPause' in k and k.replace('PlayPause', 'Play') in annotations or \
 		   'PlayPause' not in k and 'Pause' in k:
@@ -739,12 +880,14 @@ def prepare_animations(annotations):
 			annot.setValue_forAnnotationKey_(4, 'F')
 			annot.setShouldDisplay_(False)
 	
-	a = 0
-	while True:
+	for k in annotations:
+		if not k.startswith('anm'):
+			continue
 		try:
-			anim = annotations['anm%i' % a]
-		except KeyError:
-			break
+			a = int(k[len('anm'):])
+		except ValueError:
+			continue
+		anim = annotations[k]
 		flags = anim.valueForAnnotationKey_('F')
 		anim.setShouldDisplay_(False)
 		frames = []
@@ -759,8 +902,11 @@ def prepare_animations(annotations):
 				frame.setShouldDisplay_(False)
 			frames.append(frame)
 			i += 1
-		animations[a] = frames
-		a += 1
+		frames_by_animation[a] = frames
+	return frames_by_animation
+
+def prepare_animations(annotations):
+	animations.update(hide_animations(annotations))
 
 class AnimationPlayer(NSObject):
 	def play_(self, timer):
@@ -786,6 +932,7 @@ def advance_animation(a, step=0, target=None):
 	if target >= l:  target = 0 if loop else -1
 	elif target < 0: target = -1 if loop else 0
 	frames[target].setShouldDisplay_(True)
+	display_changed(frames[target].page())
 	
 	global animation_timer
 	if animation_timer:
@@ -818,6 +965,7 @@ def toggle_play_pause(a, play):
 			except KeyError:
 				continue
 			w.setShouldDisplay_(v)
+			display_changed(w.page())
 	
 def handle_animation(annotation):
 	t = annotation.valueForAnnotationKey_('T')
@@ -870,81 +1018,46 @@ def handle_animation(annotation):
 
 # scanning annotations for notes, movies and animations #####################
 
-def add_movie_pdfannotationlink(page_number, annot, movie):
-	if type(movie) == CGPDFDictionaryRef:
-		try:
-			fs = cgpdf_get(movie, 'FS')
-		except LookupError:
-			movie_filename = os.path.join(TMP_DIR_PATH, os.path.basename(cgpdf_get(movie, 'F')))
-			with open(movie_filename, 'bw') as movie_file:
-				movie_file.write(cgpdf_get(movie, 'EF', 'F'))
-			u = NSURL.fileURLWithPath_(movie_filename)
-		else:
-			u = NSURL.URLWithString_(cgpdf_get(movie, 'F'))
-	else:
-		u = url.URLByDeletingLastPathComponent().URLByAppendingPathComponent_(movie)
-	rect = cgpdf_array2list(cgpdf_get(annot, 'Rect'))
-	x0, y0, x1, y1 = rect
+# pages are scanned in the background once the windows are shown:
+# scan_structure runs in a worker thread and only touches the low level
+# pdf object structure, scan_page then updates the PDFKit document on the main thread.
+# each page is visited once by each of those, with per handler timings logged
+
+def add_movie_pdfannotationlink(page, movie_link):
+	bounds, u = movie_link
 	pdf_annotation = PDFAnnotation.alloc().initWithBounds_forType_withProperties_(
-		((x0, y0), (x1-x0, y1-y0)),
+		bounds,
 		'Link',
 		None
 	)
 	pdf_annotation.setURL_(u)
-	pdf.pageAtIndex_(page_number).addAnnotation_(pdf_annotation)
+	page.addAnnotation_(pdf_annotation)
+	display_changed(page)
 
 
 # low level annotation scanning for embedded data (media or javascript)
 
-for page_number in range(_page_count):
-	_page = CGPDFDocumentGetPage(_pdf, page_number+1)
-	_dict = CGPDFPageGetDictionary(_page)
-	try:
-		_annotations = cgpdf_get(_dict, 'Annots')
-	except LookupError:
-		continue
-	for annot in cgpdf_array2list(_annotations):
-		subtype = cgpdf_get(annot, 'Subtype')
-		if subtype == 'Movie':
-			movie_filename = cgpdf_get(annot, 'Movie', 'F')
-			add_movie_pdfannotationlink(page_number, annot, movie_filename)
-		
-		elif subtype in ['Screen', 'Widget']:
-			try:
-				po = cgpdf_get(annot, 'AA', 'PO')
-			except LookupError:
-				continue
-			po_subtype = cgpdf_get(po, 'S')
-			if po_subtype == 'JavaScript': # animate info?
-				try:
-					parse_js(cgpdf_get(po, 'JS'), page_number)
-				except:
-					pass
-			elif po_subtype == 'Rendition': # movie15 style embedded movie?
-				r = cgpdf_get(po, 'R')
-				if cgpdf_get(r, 'S') != 'MR': continue
-				c = cgpdf_get(r, 'C')
-				if cgpdf_get(c, 'S') != 'MCD': continue
-				movie = cgpdf_get(po, 'R', 'C', 'D')
-				add_movie_pdfannotationlink(page_number, annot, movie)
-		
-		elif subtype == 'RichMedia': # media9 style embedded movie?
-			content = cgpdf_get(annot, 'RichMediaContent')
-			try:
-				params = cgpdf_get(content, 'Configurations', 0, 'Instances', 0, 'Params', 'FlashVars')
-				params = dict(
-					param.split('=')
-					for param in params.split('&') if param
-				)
-				source = params['source']
-			except LookupError:
-				source = None
-			assets = iter(cgpdf_array2list(cgpdf_get(content, 'Assets', 'Names')))
-			for asset_name in assets:
-				movie = next(assets)
-				if asset_name == source:
-					break
-			add_movie_pdfannotationlink(page_number, annot, movie)
+page_scanner = pdfscan.PageScanner(_pdf, CACHE_PATH, log=lambda message: NSLog("structure: %@", message))
+
+def scan_structure(page_number, result=None):
+	"""scan durations, notes and low level annotations, return movie links"""
+	if result is None: # not already scanned by a worker process
+		if _pdf is None:
+			return []
+		try:
+			result = page_scanner.scan(page_number)
+		except LookupError:
+			return []
+	if 'duration' in result:
+		durations[page_number] = result['duration']
+	for script in result.get('scripts', []): # animate info?
+		try:
+			parse_js(script, page_number)
+		except:
+			pass
+	if 'notes' in result:
+		pdf_notes[page_number] = result['notes']
+	return result.get('movies', [])
 
 
 # high level annotation handling
@@ -952,25 +1065,95 @@ for page_number in range(_page_count):
 def annotations(page):
 	return page.annotations() or []
 
+class PageLinks(object):
+	"""Link and Widget annotations of a page, with their bounds in a grid for
+	hit tests, and what clicks and tooltips need resolved once"""
+	def __init__(self, page):
+		self.annotations = [annotation for annotation in annotations(page)
+		                    if annotation.type() in ['Link', 'Widget']]
+		self.grid = indexes.Grid(annotation.bounds() for annotation in self.annotations)
+		self.tooltips = [annotation.toolTip() or "" for annotation in self.annotations]
+		self.urls = [annotation.URL() for annotation in self.annotations]
+		self.pages = [] # destination page index, if any
+		for annotation in self.annotations:
+			destination = annotation.destination()
+			self.pages.append(None if destination is None else pdf.indexForPage_(destination.page()))
+	
+	def at(self, point):
+		"""index of the topmost displayed annotation at point, if any (as the
+		cursor rects)"""
+		for i in self.grid.at(point.x, point.y):
+			if self.annotations[i].shouldDisplay():
+				return i
+		return None
+
+links_tables = {}
+
+def page_links(page_number):
+	"""links of page, built on first use (and again when the page is scanned)"""
+	links = links_tables.get(page_number)
+	if links is None:
+		links = links_tables[page_number] = PageLinks(pdf.pageAtIndex_(page_number))
+	return links
+
 pdf_notes = defaultdict(list)
 movies = {}
+probing = set() # link annotations waiting for get_movie
 widgets = {}
-for page_number in range(page_count):
-	page = pdf.pageAtIndex_(page_number)
+
+# posters are placed once their movie is probed: poster_rect is the bounds
+# of the link fitted to the poster aspect ratio, and the full screen icon
+# is drawn left of icon_anchor (its size depends on the view transform)
+
+Media = namedtuple('Media', ['annotation', 'bounds', 'poster', 'poster_rect', 'icon_anchor'])
+media = {} # page number -> [Media], only for pages with posters
+
+def place_media(annotation, poster):
+	bounds = annotation.bounds()
+	(x, y), (w, h) = bounds
+	poster_size = poster.size()
+	aspect_ratio = (poster_size.width*h)/(w*poster_size.height)
+	if aspect_ratio < 1:
+		dw = w * (1.-aspect_ratio)
+		poster_rect = ((x+dw/2., y), (w-dw, h))
+	else:
+		dh = h * (1.-1./aspect_ratio)
+		poster_rect = ((x, y+dh/2.), (w, h-dh))
+	return Media(annotation, bounds, poster, poster_rect, (x+w-3, y+h/6+3))
+
+def movie_probed(page_number, annotation, movie):
+	probing.discard(annotation)
+	if movie:
+		movies[annotation] = movie
+		_, poster = movie
+		if poster is not None and annotation.bounds().size.height >= MIN_POSTER_HEIGHT:
+			media.setdefault(page_number, []).append(place_media(annotation, poster))
+		refresher.refresh()
+
+HIDDEN_ANNOTATIONS = ['Text', 'Movie', 'Screen', 'FileAttachment', 'RichMedia']
+
+def hide_annotations(page):
+	"""hide notes, media and animation frames (but the first), return the
+	widgets of page by name"""
+	page_widgets = {}
 	for annotation in annotations(page):
 		annotation_type = annotation.type()
-		if annotation_type == 'Text':
+		if annotation_type in HIDDEN_ANNOTATIONS:
 			annotation.setShouldDisplay_(False)
-			pdf_notes[page_number].append(annotation.contents().replace('\r', '\n'))
-		elif annotation_type == 'Link':
-			movie = get_movie(annotation.URL())
-			if movie:
-				movies[annotation] = movie
 		elif annotation_type == 'Widget':
-			widgets[annotation.valueForAnnotationKey_('T')] = annotation
-		elif annotation_type in ['Movie', 'Screen', 'FileAttachment', 'RichMedia']:
-			annotation.setShouldDisplay_(False)
-prepare_animations(widgets)
+			page_widgets[annotation.valueForAnnotationKey_('T')] = annotation
+	display_changed(page)
+	return page_widgets
+
+def scan_annotations(page_number, page):
+	for annotation in annotations(page):
+		if annotation.type() == 'Link' and is_movie(annotation.URL()):
+			probing.add(annotation)
+			get_movie(annotation.URL(), lambda movie, annotation=annotation: movie_probed(page_number, annotation, movie))
+	page_widgets = hide_annotations(page)
+	widgets.update(page_widgets)
+	prepare_animations(page_widgets)
+	links_tables[page_number] = PageLinks(page)
 
 
 # beamer notes
@@ -983,7 +1166,8 @@ title_page = pdf.pageAtIndex_(0)
 (x, y), (w, h) = title_page.boundsForBox_(kPDFDisplayBoxMediaBox)
 ratio = w/h
 
-if ratio > 7/3: # likely to be a two screens pdf
+two_screens = ratio > 7/3 # likely to be a two screens pdf
+if two_screens:
 	# heuristic to guess template of note slide
 	ratio /= 2
 	w /= 2
@@ -993,32 +1177,299 @@ if ratio > 7/3: # likely to be a two screens pdf
 		line in title
 		for line in miniature
 	)
-	for page_number in range(page_count):
-		page = pdf.pageAtIndex_(page_number)
+
+def crop(page):
+	"""crop out the notes screen of two screens pages, return the crop box"""
+	if two_screens:
 		(x, y), (w, h) = page.boundsForBox_(kPDFDisplayBoxMediaBox)
-		w /= 2
-		page.setBounds_forBox_(((x, y), (w, h)), kPDFDisplayBoxCropBox)
-		selection = page.selectionForRect_(((x+w, y), (w, 3*h/4 if header else h)))
-		beamer_notes[page_number].append('\n'.join(lines(selection)))
+		page.setBounds_forBox_(((x, y), (w/2, h)), kPDFDisplayBoxCropBox)
+	return page.boundsForBox_(kPDFDisplayBoxCropBox)
+
+def scan_beamer_notes(page_number, page):
+	if not two_screens or metadata is not None:
+		return
+	(x, y), (w, h) = page.boundsForBox_(kPDFDisplayBoxCropBox)
+	selection = page.selectionForRect_(((x+w, y), (w, 3*h/4 if header else h)))
+	beamer_notes[page_number].append('\n'.join(lines(selection)))
 
 
 # thumbnails
 
-origin = 0
-thumbnails = {}
-for page_number in range(page_count):
-	page = pdf.pageAtIndex_(page_number)
-	_, (w, h) = page.boundsForBox_(kPDFDisplayBoxCropBox)
+# miniatures layout is known up front from page geometry, while thumbnails
+# are rendered on demand by a worker thread for the pages in view (plus a
+# scroll ahead margin) and kept in a lru cache within a memory budget
+
+THUMBNAILS_BUDGET = '.'.join([ID, 'thumbnails_budget']) # in MB
+thumbnails_budget = user_defaults.integerForKey_(THUMBNAILS_BUDGET) or 64
+thumbnail_images = caches.LRUCache(thumbnails_budget<<20)
+
+def miniature_size(page_number): # single geometry pass, also cropping beamer notes
+	_, (w, h) = crop(pdf.pageAtIndex_(page_number))
 	width = MINIATURE_WIDTH-MINIATURE_MARGIN
-	height = h*width/w
-	thumbnail = page.thumbnailOfSize_forBox_((width, height), kPDFDisplayBoxCropBox)
-	thumbnails[page_number] = (width, height, origin), thumbnail
-	origin += height + MINIATURE_MARGIN
-MINIATURES_HEIGHT = origin
+	return width, h*width/w
+
+miniature_sizes = [miniature_size(page_number) for page_number in range(page_count)]
+
+# in collapsed mode, the last overlay of each frame stands for the whole frame,
+# except for the frames of the current and hovered pages that are expanded
+
+def layout_miniatures(collapsed=False, expanded_pages=()):
+	global thumbnails, miniature_pages, miniature_index, MINIATURES_HEIGHT
+	expanded = {navigation.frame(page) for page in expanded_pages if page is not None}
+	miniature_pages = []
+	for start, end in navigation.frames():
+		if collapsed and (start, end) not in expanded:
+			miniature_pages.append(end-1)
+		else:
+			miniature_pages.extend(range(start, end))
+	miniature_index = {page: i for i, page in enumerate(miniature_pages)}
+	thumbnails = indexes.Strip(
+		(miniature_sizes[page] for page in miniature_pages), MINIATURE_MARGIN)
+	MINIATURES_HEIGHT = thumbnails.height
+layout_miniatures()
+
+# thumbnails are persisted across launches in an atlas of pixel strips,
+# keyed by a hash of the page content so that only changed pages are rendered
+
+thumbnails_scale = NSScreen.mainScreen().backingScaleFactor()
+STRIP_WIDTH = int((MINIATURE_WIDTH-MINIATURE_MARGIN)*thumbnails_scale)
+device_rgb = CGColorSpaceCreateDeviceRGB()
+
+def strip_height(height):
+	return max(1, int(round(height*thumbnails_scale)))
+
+def image_pixels(image, height):
+	"""draw image in a strip, return its rgba pixels"""
+	context = CGBitmapContextCreate(None, STRIP_WIDTH, height, 8, STRIP_WIDTH*4,
+	                                device_rgb, kCGImageAlphaPremultipliedLast)
+	NSGraphicsContext.saveGraphicsState()
+	NSGraphicsContext.setCurrentContext_(
+		NSGraphicsContext.graphicsContextWithCGContext_flipped_(context, False))
+	image.drawInRect_(((0, 0), (STRIP_WIDTH, height)))
+	NSGraphicsContext.restoreGraphicsState()
+	image = CGBitmapContextCreateImage(context)
+	return bytes(CGDataProviderCopyData(CGImageGetDataProvider(image)))
+
+def pixels_image(pixels, height, size):
+	"""image of the given size (in points) from the rgba pixels of a strip"""
+	provider = CGDataProviderCreateWithCFData(NSData.dataWithBytes_length_(pixels, len(pixels)))
+	image = CGImageCreate(STRIP_WIDTH, height, 8, 32, STRIP_WIDTH*4,
+	                      device_rgb, kCGImageAlphaPremultipliedLast, provider,
+	                      None, False, kCGRenderingIntentDefault)
+	return NSImage.alloc().initWithCGImage_size_(image, size)
+
+def open_atlas():
+	"""return the atlas and the structure used for page hashes, if available"""
+	try:
+		structure = pdfreader.Document(url.path()) # not shared with the scanner
+		return caches.Atlas(ATLAS_PATH, STRIP_WIDTH, page_count), structure
+	except (OSError, pdfreader.PDFError) as e:
+		NSLog("unable to open thumbnails atlas: %@", str(e))
+		return None, None
+
+def image_size(image):
+	"""estimated memory footprint of an image, in bytes"""
+	w, h = image.size()
+	pixels = sum(rep.pixelsWide()*rep.pixelsHigh() for rep in image.representations())
+	return max(pixels, w*h) * 4
+
+class Thumbnailer(NSObject):
+	"""render thumbnails in a worker thread, latest request first"""
+	def init(self):
+		assert NSObject.init(self) == self
+		self.wanted = []
+		self.rendered = set() # not yet stored in cache
+		self.condition = threading.Condition()
+		return self
+	
+	def request(self, page_numbers):
+		"""replace previous requests, pages in cache are skipped"""
+		with self.condition:
+			self.wanted = [
+				page_number for page_number in page_numbers
+				if page_number not in thumbnail_images and page_number not in self.rendered
+			]
+			self.condition.notify()
+	
+	def start(self):
+		NSThread.detachNewThreadSelector_toTarget_withObject_("run:", self, None)
+	
+	def run_(self, _):
+		document = PDFDocument.alloc().initWithURL_(url) # not shared with main thread
+		atlas, structure = open_atlas()
+		while document:
+			with self.condition:
+				while not self.wanted:
+					self.condition.wait()
+				page_number = self.wanted.pop(0)
+				self.rendered.add(page_number)
+			with autorelease_pool():
+				image = self.render(document, atlas, structure, page_number)
+				self.performSelectorOnMainThread_withObject_waitUntilDone_modes_(
+					"store:", (page_number, image), False, [NSDefaultRunLoopMode])
+	
+	def render(self, document, atlas, structure, page_number):
+		"""map the thumbnail from the atlas, or render and patch it in"""
+		width, height = miniature_sizes[page_number]
+		pixels_height = strip_height(height)
+		key = None
+		if atlas is not None:
+			try:
+				key = pdfscan.page_hash(structure, page_number)
+			except (LookupError, TypeError, pdfreader.PDFError):
+				pass
+		if key is not None:
+			pixels = atlas.get(page_number, key, pixels_height)
+			if pixels is not None:
+				return pixels_image(pixels, pixels_height, (width, height))
+		
+		page = document.pageAtIndex_(page_number)
+		crop(page)
+		hide_animations(hide_annotations(page)) # as on the main document
+		image = page.thumbnailOfSize_forBox_((width, height), kPDFDisplayBoxCropBox)
+		if key is not None:
+			try:
+				atlas.put(page_number, key, pixels_height, image_pixels(image, pixels_height))
+			except OSError as e:
+				NSLog("unable to update thumbnails atlas: %@", str(e))
+		return image
+	
+	def store_(self, result):
+		page_number, image = result
+		thumbnail_images.put(page_number, image, image_size(image))
+		with self.condition:
+			self.rendered.discard(page_number)
+		refresher.refresh([presenter_view])
+thumbnailer = Thumbnailer.alloc().init()
+
+
+# background scanning #######################################################
+
+movie_links = {} # low level movie links by page, with cacheable urls
+
+if metadata is not None:
+	durations.update(metadata['durations'])
+	pdf_notes.update(metadata['pdf_notes'])
+	beamer_notes.update(metadata['beamer_notes'])
+	animations_state.update(metadata['animations_state'])
+	autoplay_animations.update(metadata['autoplay_animations'])
+	movie_links.update(metadata['movie_links'])
+
+def get_movie_links(page_number):
+	"""scan page structure unless already cached"""
+	if metadata is None and page_number not in movie_links:
+		movie_links[page_number] = scan_structure(page_number)
+	return [
+		(bounds, NSURL.URLWithString_(u))
+		for bounds, u in movie_links.get(page_number, [])
+	]
+
+def collect_metadata():
+	return {
+		'durations':           durations,
+		'labels':              navigation.labels,
+		'sections':            sections,
+		'pdf_notes':           dict(pdf_notes),
+		'beamer_notes':        dict(beamer_notes),
+		'animations_state':    animations_state,
+		'autoplay_animations': dict(autoplay_animations),
+		'movie_links':         {p: l for p, l in movie_links.items() if l},
+	}
+
+
+def scan_links(page_number, page, links):
+	for movie_link in links:
+		add_movie_pdfannotationlink(page, movie_link)
+
+page_handlers = pdfscan.Handlers(log=lambda message: NSLog("document: %@", message))
+page_handlers.register('links',        scan_links)
+page_handlers.register('annotations',  lambda n, page, _: scan_annotations(n, page))
+page_handlers.register('beamer notes', lambda n, page, _: scan_beamer_notes(n, page))
+
+
+class Scanner(NSObject):
+	"""scan pages in a worker thread, current page first"""
+	def init(self):
+		assert NSObject.init(self) == self
+		self.scanned = set()
+		self.wanted = None
+		self.duration = 0.
+		return self
+	
+	def progress(self):
+		return len(self.scanned) / page_count
+	
+	def is_scanned(self, page_number):
+		return page_number in self.scanned
+	
+	def prioritize(self, page_number):
+		self.wanted = page_number
+	
+	def scan_page(self, page_number, links=None):
+		"""update the PDFKit document, must be called from main thread"""
+		if page_number in self.scanned:
+			return
+		if links is None:
+			links = get_movie_links(page_number)
+		page = pdf.pageAtIndex_(page_number) # fetched once for all handlers
+		page_handlers(page_number, page, links)
+		self.scanned.add(page_number)
+		refresher.refresh()
+	
+	def apply_(self, result):
+		page_number, links = result
+		self.scan_page(page_number, links)
+		if page_number == current_page: # page turned while not yet scanned
+			handle_turn(page_number)
+	
+	def start(self):
+		self.scan_page(current_page)
+		NSThread.detachNewThreadSelector_toTarget_withObject_("run:", self, None)
+	
+	def run_(self, _):
+		start = time.time()
+		pending = list(range(current_page+1, page_count)) + list(range(current_page))
+		pending.reverse()
+		
+		def apply(page_number):
+			if pending[-1] == page_number:
+				pending.pop()
+			else:
+				pending.remove(page_number)
+			if page_number in self.scanned:
+				return
+			with autorelease_pool():
+				result = page_number, get_movie_links(page_number)
+				# one page at a time so that events are handled in between
+				self.performSelectorOnMainThread_withObject_waitUntilDone_modes_(
+					"apply:", result, True, [NSDefaultRunLoopMode])
+		
+		if metadata is None and _pdf is not None and scan_jobs > 1:
+			# pages are applied as workers send them, the wanted one first
+			for page_number, result in pdfscan.scan_parallel(page_scanner, scan_jobs):
+				if page_number not in movie_links: # current page is already scanned
+					movie_links[page_number] = scan_structure(page_number, result)
+				if self.wanted in pending:
+					apply(self.wanted)
+				if page_number in pending:
+					apply(page_number)
+		while pending: # pages left out by workers, or all pages
+			apply(self.wanted if self.wanted in pending else pending[-1])
+		self.duration = time.time() - start
+		NSLog("scanned %d pages in %.2fs", page_count, self.duration)
+		NSLog("structure: %@", page_scanner.report())
+		NSLog("document: %@", page_handlers.report())
+		if metadata is None:
+			try:
+				save_metadata(collect_metadata())
+			except OSError as e:
+				NSLog("unable to save metadata cache: %@", str(e))
+scanner = Scanner.alloc().init()
+
 
-drawings = defaultdict(list)
+drawings = defaultdict(ink.Strokes)
 BOARD = -1
-frame_pages.append([BOARD])
+history = ink.History() # of the changes of drawings and bboxes
 
 
 # page drawing ##############################################################
@@ -1033,6 +1484,56 @@ color_chooser.setMode_(NSColorPanelModeCrayon)
 color_chooser.setColor_(NSColor.blackColor())
 color_chooser.setShowsAlpha_(True)
 
+
+# session journal
+
+# the current page, timer, zoom boxes and strokes are journaled as they change
+# (the journal thread pickles and syncs them), and recovered when the document
+# is opened again after a crash
+
+session_journal = None # started once the recovered state is restored
+
+def record_session(key, value):
+	if session_journal is not None:
+		session_journal.record(key, value)
+
+def record_page():
+	record_session('page', current_page)
+
+def record_timer():
+	p = presenter_view
+	record_session('timer', (p.duration, p.elapsed_duration, p.start_time, p.absolute_time))
+
+def record_bboxes():
+	record_session(('bbox', 'slide'), transform_matrix(slide_bbox))
+	record_session(('bbox', 'board'), transform_matrix(board_bbox))
+
+def record_ink(page):
+	strokes = drawings.get(page) # not creating an entry for pages never drawn
+	if strokes is not None:
+		record_session(('ink', page), strokes.__getstate__())
+
+def session_snapshot():
+	yield 'page', current_page
+	p = presenter_view
+	yield 'timer', (p.duration, p.elapsed_duration, p.start_time, p.absolute_time)
+	yield ('bbox', 'slide'), transform_matrix(slide_bbox)
+	yield ('bbox', 'board'), transform_matrix(board_bbox)
+	for page, strokes in drawings.items():
+		if strokes:
+			yield ('ink', page), strokes.__getstate__()
+
+for key, value in recovered.items():
+	if key == ('bbox', 'slide'):
+		slide_bbox.setTransformStruct_(value)
+	elif key == ('bbox', 'board'):
+		board_bbox.setTransformStruct_(value)
+	elif key[0] == 'ink':
+		_, page = key
+		_, _, ids, *_ = value
+		if ids: # pages erased since are left out
+			drawings[page].__setstate__(value)
+
 def stroke(path, color=NSColor.blackColor(), outline=NSColor.whiteColor(), size=1):
 	if outline and color.alphaComponent() >= 1.:
 		outline.setStroke()
@@ -1042,49 +1543,357 @@ def stroke(path, color=NSColor.blackColor(), outline=NSColor.whiteColor(), size=
 	path.setLineWidth_(size)
 	path.stroke()
 
+def color_components(color):
+	"""rgba of an NSColor, as stored with strokes"""
+	color = color.colorUsingColorSpace_(NSColorSpace.deviceRGBColorSpace())
+	return color.getRed_green_blue_alpha_(None, None, None, None)
+
+def stroke_color(strokes, i):
+	return NSColor.colorWithDeviceRed_green_blue_alpha_(*strokes.color(i))
+
+def stroke_path(strokes, i):
+	start, segments = strokes.curve(i)
+	path = NSBezierPath.bezierPath()
+	path.setLineCapStyle_(NSRoundLineCapStyle)
+	path.setLineJoinStyle_(NSRoundLineJoinStyle)
+	path.moveToPoint_(start)
+	for c1, c2, p in segments:
+		path.curveToPoint_controlPoint1_controlPoint2_(p, c1, c2)
+	return path
+
+def draw_stroke(strokes, i, outline=NSColor.whiteColor()):
+	stroke(stroke_path(strokes, i), stroke_color(strokes, i),
+	       outline=outline, size=strokes.width(i))
+
+SIMPLIFY_TOLERANCE = 1.5 # in pixels of the presentation (see the ink benchmark)
+
+def export_ink():
+	"""write the strokes as pdf annotations to a copy of the document"""
+	if _pdf is None:
+		NSLog("unable to export annotations: the document could not be parsed")
+		return
+	path = os.path.splitext(_pdf.path)[0] + '-annotated.pdf'
+	board = drawings.get(BOARD) # not creating an entry
+	start = time.time()
+	try:
+		ink.export(_pdf, path,
+			{page: strokes for page, strokes in drawings.items() if page != BOARD},
+			None if board is None else (board, tuple(board_view.bounds().size)))
+	except (OSError, pdfreader.PDFError) as e:
+		NSLog("unable to export annotations: %@", str(e))
+		return
+	NSLog("annotations exported to %@ in %.2fs", path, time.time()-start)
+	NSWorkspace.sharedWorkspace().activateFileViewerSelectingURLs_([NSURL.fileURLWithPath_(path)])
+
+def transform_matrix(transform):
+	m = transform.transformStruct()
+	return m.m11, m.m12, m.m21, m.m22, m.tX, m.tY
+
 
 def draw_page(page):
 	NSEraseRect(page.boundsForBox_(kPDFDisplayBoxCropBox))
 	page.drawWithBox_(kPDFDisplayBoxCropBox)
 	
-	for annotation in annotations(page):
-		if not annotation in movies:
-			continue
-		bounds = annotation.bounds()
-		
-		_, poster = movies[annotation]
-		if poster is None:
+	if not media:
+		return
+	for placement in media.get(pdf.indexForPage_(page), ()):
+		placement.poster.drawInRect_fromRect_operation_fraction_(
+			placement.poster_rect, NSZeroRect, NSCompositingOperationCopy, 1.
+		)
+
+
+# rendered pages are cached as bitmaps, keyed by page, pixel size and the
+# state of what draw_page depends on (a count of the changes of the annotations
+# shown, see display_changed, and movie posters). Only pages drawn without zoom
+# (a bbox translated at most) are cached, zoomed ones are drawn directly,
+# clipped to what is visible, rather than rendered whole at each zoom step.
+
+RENDERED_PAGES_BUDGET = '.'.join([ID, 'rendered_pages_budget']) # in MB
+rendered_pages_budget = user_defaults.integerForKey_(RENDERED_PAGES_BUDGET) or 256
+rendered_pages = caches.LRUCache(rendered_pages_budget<<20)
+MAX_RENDERED_PIXELS = 1<<24 # pages above that size are drawn directly
+
+def zoomed(bbox):
+	if bbox is None:
+		return False
+	m = bbox.transformStruct()
+	return (m.m11, m.m12, m.m21, m.m22) != ink.IDENTITY[:4]
+
+class BBoxChange(ink.Command):
+	"""change of slide_bbox or board_bbox, from the before matrix to its
+	current one (successive changes are merged, e.g. while scrolling)"""
+	def __init__(self, bbox, before):
+		self.bbox = bbox
+		self.before = before
+		self.after = transform_matrix(bbox)
+		self.time = time.time()
+
+	def set(self, matrix):
+		self.bbox.setTransformStruct_(matrix)
+
+	def undo(self):
+		self.set(self.before)
+
+	def redo(self):
+		self.set(self.after)
+
+	def merge(self, command):
+		if not isinstance(command, BBoxChange) or command.bbox is not self.bbox or \
+		   command.time - self.time > ink.MERGE_DELAY:
+			return False
+		self.after, self.time = command.after, command.time
+		return True
+
+def render_page(page, pixels_size):
+	(x, y), (w, h) = page.boundsForBox_(kPDFDisplayBoxCropBox)
+	pixels_wide, pixels_high = pixels_size
+	bitmap = NSBitmapImageRep.alloc().initWithBitmapDataPlanes_pixelsWide_pixelsHigh_bitsPerSample_samplesPerPixel_hasAlpha_isPlanar_colorSpaceName_bytesPerRow_bitsPerPixel_(
+		None, pixels_wide, pixels_high, 8, 4, True, False, NSDeviceRGBColorSpace, 0, 0)
+	bitmap.setSize_((w, h))
+	NSGraphicsContext.saveGraphicsState()
+	NSGraphicsContext.setCurrentContext_(NSGraphicsContext.graphicsContextWithBitmapImageRep_(bitmap))
+	transform = NSAffineTransform.transform()
+	transform.translateXBy_yBy_(-x, -y)
+	transform.concat()
+	draw_page(page)
+	NSGraphicsContext.restoreGraphicsState()
+	image = NSImage.alloc().initWithSize_((w, h))
+	image.addRepresentation_(bitmap)
+	return image
+
+def rendered_page_key(view, page, transform, bbox):
+	"""cache key of page drawn in view with transform and bbox (if any) concatenated,
+	None if zoomed or too large to be cached"""
+	if zoomed(bbox):
+		return None
+	page_rect = page.boundsForBox_(kPDFDisplayBoxCropBox)
+	to_view = NSAffineTransform.alloc().initWithTransform_(transform)
+	if bbox is not None:
+		to_view.prependTransform_(bbox)
+	w, h = view.convertSizeToBacking_(to_view.transformSize_(page_rect.size))
+	pixels_size = int(abs(w)+.5), int(abs(h)+.5)
+	if pixels_size[0]*pixels_size[1] > MAX_RENDERED_PIXELS:
+		return None
+	page_number = pdf.indexForPage_(page)
+	return (
+		page_number, pixels_size,
+		display_generations[page_number],
+		len(media.get(page_number, ())),
+	)
+
+def cache_rendered_page(key, page):
+	_, pixels_size, *_ = key
+	image = render_page(page, pixels_size)
+	rendered_pages.put(key, image, pixels_size[0]*pixels_size[1]*4)
+	return image
+
+def draw_cached_page(view, page, transform, bbox):
+	"""draw_page through the bitmap cache"""
+	key = rendered_page_key(view, page, transform, bbox)
+	if key is None:
+		draw_page(page)
+		return
+	image = rendered_pages.get(key)
+	if image is None:
+		image = cache_rendered_page(key, page)
+	else:
+		prefetcher.shown(key)
+	image.drawInRect_fromRect_operation_fraction_(
+		page.boundsForBox_(kPDFDisplayBoxCropBox), NSZeroRect, NSCompositingOperationCopy, 1.
+	)
+
+
+# prefetching
+
+# likely next pages are rendered at presentation resolution while idle, on the
+# main thread since PDFKit pages (and their annotations) are shared with drawing
+
+PREFETCH_DELAY = .1 # let the current page be drawn first
+PREFETCH_PAGES = 4
+
+class Prefetcher(NSObject):
+	"""render likely targets in the bitmap cache, one page per run loop pass"""
+	def init(self):
+		assert NSObject.init(self) == self
+		self.pending = []
+		self.direction = 1
+		self.prefetched = set() # keys rendered ahead, not yet shown
+		self.turns = self.served = 0
+		return self
+	
+	def targets(self, page):
+		"""likely targets from page, in the direction of navigation first"""
+		forward = [
+			page+1,
+			navigation.next(navigation.starts, page),
+			navigation.next(navigation.sections, page),
+		]
+		backward = [
+			page-1,
+			navigation.prev(navigation.starts, page),
+		]
+		if self.direction < 0:
+			forward, backward = backward, forward
+		targets = forward + backward + past_pages[-1:]
+		targets = [p for p in targets if first_page <= p <= last_page and p != page]
+		return list(dict.fromkeys(targets))[:PREFETCH_PAGES]
+	
+	def turned(self, previous, page):
+		"""replace stale work by the targets from the new page"""
+		self.turns += 1
+		if page != previous:
+			self.direction = 1 if page > previous else -1
+		self.pending = self.targets(page)
+		NSObject.cancelPreviousPerformRequestsWithTarget_(self)
+		self.performSelector_withObject_afterDelay_("prefetch:", None, PREFETCH_DELAY)
+	
+	def prefetch_(self, _):
+		while self.pending:
+			page_number = self.pending.pop(0)
+			if not scanner.is_scanned(page_number): # annotations would change
+				continue
+			page = pdf.pageAtIndex_(page_number)
+			key = rendered_page_key(slide_view, page, slide_view.page_transform(page), slide_bbox)
+			if key is None or key in rendered_pages:
+				continue
+			cache_rendered_page(key, page)
+			self.prefetched.add(key)
+			break
+		if self.pending:
+			self.performSelector_withObject_afterDelay_("prefetch:", None, 0.)
+	
+	def shown(self, key):
+		if key in self.prefetched:
+			self.prefetched.discard(key)
+			self.served += 1
+	
+	def stats(self):
+		return "%d/%d turns served from prefetch" % (self.served, self.turns)
+prefetcher = Prefetcher.alloc().init()
+
+
+# ink rasters
+
+# the strokes shown by a view are kept drawn in a transparent bitmap of the view
+# size, so that a redraw composites a single image however many strokes there
+# are. Strokes appended since are drawn on top of it, and so are the segments
+# added to the stroke being drawn (see add_ink_segment), any other change
+# (strokes erased or (un)selected, view or bbox transformed) draws it again
+# from scratch
+
+ink_rasters = {} # view -> [key, image, bitmap, [[stroke id, point count]]]
+
+def begin_ink(raster, to_raster):
+	_, _, bitmap, _ = raster
+	NSGraphicsContext.saveGraphicsState()
+	NSGraphicsContext.setCurrentContext_(NSGraphicsContext.graphicsContextWithBitmapImageRep_(bitmap))
+	to_raster.concat()
+
+def end_ink():
+	NSGraphicsContext.restoreGraphicsState()
+
+def draw_ink(view, pages, to_view, outline=NSColor.whiteColor(), selection=(), selection_outline=None):
+	"""draw the strokes of pages through the view ink raster, to_view being
+	the transform (already concatenated) from strokes to view coordinates.
+	Selected strokes are left out of the raster and drawn over it, since they
+	may be moving"""
+	(x, y), size = view.bounds()
+	to_raster = NSAffineTransform.alloc().initWithTransform_(to_view)
+	to_bounds = NSAffineTransform.transform()
+	to_bounds.translateXBy_yBy_(-x, -y)
+	to_raster.appendTransform_(to_bounds)
+	key = tuple(pages), tuple(size), transform_matrix(to_raster), outline
+	strokes, selected = [], []
+	for page in pages:
+		store = drawings[page]
+		for i, stroke_id in enumerate(store.ids):
+			(selected if stroke_id in selection else strokes).append((store, i))
+	
+	raster = ink_rasters.get(view)
+	if raster is not None:
+		_, _, _, drawn = raster
+		if raster[0] != key or len(drawn) > len(strokes) or any(
+			stroke_id != store.ids[i] or count != store.point_count(i)
+			for (stroke_id, count), (store, i) in zip(drawn, strokes)
+		):
+			raster = None
+	if raster is None:
+		pixels_wide, pixels_high = view.convertSizeToBacking_(size)
+		bitmap = NSBitmapImageRep.alloc().initWithBitmapDataPlanes_pixelsWide_pixelsHigh_bitsPerSample_samplesPerPixel_hasAlpha_isPlanar_colorSpaceName_bytesPerRow_bitsPerPixel_(
+			None, int(pixels_wide+.5), int(pixels_high+.5), 8, 4, True, False, NSDeviceRGBColorSpace, 0, 0)
+		bitmap.setSize_(size)
+		image = NSImage.alloc().initWithSize_(size)
+		image.addRepresentation_(bitmap)
+		raster = ink_rasters[view] = [key, image, bitmap, []]
+	
+	_, image, _, drawn = raster
+	if len(drawn) < len(strokes):
+		begin_ink(raster, to_raster)
+		for store, i in strokes[len(drawn):]:
+			draw_stroke(store, i, outline=outline)
+			drawn.append([store.ids[i], store.point_count(i)])
+		end_ink()
+	
+	NSGraphicsContext.saveGraphicsState()
+	from_view = NSAffineTransform.alloc().initWithTransform_(to_view)
+	from_view.invert()
+	from_view.concat()
+	image.drawInRect_fromRect_operation_fraction_(
+		view.bounds(), NSZeroRect, NSCompositingOperationSourceOver, 1.
+	)
+	NSGraphicsContext.restoreGraphicsState()
+	for store, i in selected:
+		draw_stroke(store, i, outline=selection_outline or outline)
+
+def add_ink_segment(strokes, p0, p1, point_count):
+	"""draw only the segment [p0, p1] just added to the last of strokes (then
+	made of point_count points) on the rasters that have the rest of it,
+	translucent strokes are drawn again whole since their segments would
+	overlap at joints.
+	Once simplified, the stroke stays within tolerance of the segments drawn."""
+	i = len(strokes)-1
+	color, size = stroke_color(strokes, i), strokes.width(i)
+	for view, raster in ink_rasters.items():
+		key, _, _, drawn = raster
+		if not drawn or drawn[-1] != [strokes.ids[i], point_count]:
 			continue
-		
-		if bounds.size.height < MIN_POSTER_HEIGHT:
+		if color.alphaComponent() < 1.:
+			drawn[-1][1] = -1 # its last point may have moved, draw it again
 			continue
-		
-		poster_size = poster.size()
-		aspect_ratio = ((poster_size.width*bounds.size.height)/
-		                (bounds.size.width*poster_size.height))
-		if aspect_ratio < 1:
-			dw = bounds.size.width * (1.-aspect_ratio)
-			bounds.origin.x += dw/2.
-			bounds.size.width -= dw
-		else:
-			dh = bounds.size.height * (1.-1./aspect_ratio)
-			bounds.origin.y += dh/2.
-			bounds.size.height -= dh
-		
-		poster.drawInRect_fromRect_operation_fraction_(
-			bounds, NSZeroRect, NSCompositingOperationCopy, 1.
-		)
+		_, _, m, outline = key
+		to_raster = NSAffineTransform.transform()
+		to_raster.setTransformStruct_(m)
+		begin_ink(raster, to_raster)
+		segment = NSBezierPath.bezierPath()
+		segment.setLineCapStyle_(NSRoundLineCapStyle)
+		segment.moveToPoint_(p0)
+		segment.lineToPoint_(p1)
+		if outline:
+			# below the ink already drawn, as if the whole stroke was outlined first
+			NSGraphicsContext.currentContext().setCompositingOperation_(NSCompositingOperationDestinationOver)
+			outline.setStroke()
+			segment.setLineWidth_(size+1)
+			segment.stroke()
+			NSGraphicsContext.currentContext().setCompositingOperation_(NSCompositingOperationSourceOver)
+		color.setStroke()
+		segment.setLineWidth_(size)
+		segment.stroke()
+		end_ink()
+		drawn[-1][1] = strokes.point_count(i)
 
 
 # presentation ##############################################################
 
-def draw_cursor(x, y, iw, ih):
-	cursor_bounds = NSRect()
+def cursor_bounds(x, y, iw, ih):
+	bounds = NSRect()
 	W, H = CURSOR.size()
-	cursor_bounds.size = (W/iw, H/ih)
-	cursor_bounds.origin = x-X_hot/iw, y-(H-Y_hot)/ih
+	bounds.size = (W/iw, H/ih)
+	bounds.origin = x-X_hot/iw, y-(H-Y_hot)/ih
+	return bounds
+
+def draw_cursor(x, y, iw, ih):
 	CURSOR.drawInRect_fromRect_operation_fraction_(
-		cursor_bounds, NSZeroRect, NSCompositingOperationSourceAtop, 1.
+		cursor_bounds(x, y, iw, ih), NSZeroRect, NSCompositingOperationSourceAtop, 1.
 	)
 
 
@@ -1096,6 +1905,20 @@ class SlideView(NSView):
 	show_cursor = False
 	show_spotlight = NO_LIGHT
 	hide_timer = None
+	page_to_view = None
+	cursor_extent = None # cursor (or laser) bounds relative to cursor_location
+	cursor_rect = None   # where it was last drawn, in view coordinates
+	
+	def page_transform(self, page):
+		"""fit page centered in view"""
+		width, height = self.bounds().size
+		_, (w, h) = page.boundsForBox_(kPDFDisplayBoxCropBox)
+		r = min(width/w, height/h)
+		transform = NSAffineTransform.transform()
+		transform.translateXBy_yBy_(width/2., height/2.)
+		transform.scaleXBy_yBy_(r, r)
+		transform.translateXBy_yBy_(-w/2., -h/2.)
+		return transform
 	
 	def drawRect_(self, rect):
 		bounds = self.bounds()
@@ -1105,21 +1928,15 @@ class SlideView(NSView):
 		
 		# current page
 		page = pdf.pageAtIndex_(current_page)
-		page_rect = page.boundsForBox_(kPDFDisplayBoxCropBox)
-		_, (w, h) = page_rect
-		r = min(width/w, height/h)
 		
 		NSGraphicsContext.saveGraphicsState()
-		transform = NSAffineTransform.transform()
-		transform.translateXBy_yBy_(width/2., height/2.)
-		transform.scaleXBy_yBy_(r, r)
-		transform.translateXBy_yBy_(-w/2., -h/2.)
+		transform = self.page_transform(page)
 		transform.concat()
 		slide_bbox.concat()
-		draw_page(page)
-		for page in frame_pages[current_page]:
-			for path, color, size in drawings[page]:
-				stroke(path, color, size=size)
+		draw_cached_page(self, page, transform, slide_bbox)
+		to_view = NSAffineTransform.alloc().initWithTransform_(slide_bbox)
+		to_view.appendTransform_(transform)
+		draw_ink(self, frame_pages(current_page), to_view, selection=presenter_view.selection)
 		
 		x, y = cursor_location
 		if self.show_spotlight:
@@ -1142,13 +1959,47 @@ class SlideView(NSView):
 			iw, ih = transform.transformSize_((1./self.cursor_scale, 1./self.cursor_scale))
 			draw_cursor(x, y, iw, ih)
 		
+		self.page_to_view = to_view
+		if self.show_spotlight == LASER:
+			self.cursor_extent = ((-r/4., -r/4.), (r/2., r/2.))
+		elif self.show_cursor and not self.show_spotlight:
+			(cx, cy), size = cursor_bounds(x, y, iw, ih)
+			self.cursor_extent = ((cx-x, cy-y), size)
+		else:
+			self.cursor_extent = None
+		self.cursor_rect = self.cursorRect()
+		
 		self.transform = transform
 		self.transform.invert()
 		NSGraphicsContext.restoreGraphicsState()
 	
+	def cursorRect(self):
+		"""bounds of the cursor at cursor_location, in view coordinates"""
+		if self.cursor_extent is None:
+			return None
+		(dx, dy), size = self.cursor_extent
+		x, y = cursor_location
+		return transform_rect(self.page_to_view, ((x+dx, y+dy), size))
+	
+	def damagePageRect_(self, rect):
+		if self.page_to_view is None:
+			self.setNeedsDisplay_(True)
+		else:
+			refresher.damage(self, transform_rect(self.page_to_view, rect))
+	
+	def damageCursor(self):
+		"""redraw where the cursor was and where it is now"""
+		if self.page_to_view is None or self.show_spotlight == HIGH_LIGHT or \
+		   (self.show_cursor and self.cursor_extent is None): # extent not known yet
+			self.setNeedsDisplay_(True)
+			return
+		for rect in [self.cursor_rect, self.cursorRect()]:
+			if rect is not None:
+				refresher.damage(self, rect)
+	
 	def showCursor(self):
 		self.show_cursor = True
-		self.setNeedsDisplay_(True)
+		self.damageCursor()
 		if self.hide_timer:
 			self.hide_timer.invalidate()
 		self.hide_timer = NSTimer.scheduledTimerWithTimeInterval_target_selector_userInfo_repeats_(
@@ -1158,7 +2009,9 @@ class SlideView(NSView):
 	
 	def hideCursor_(self, timer):
 		self.show_cursor = False
-		self.setNeedsDisplay_(True)
+		if self.cursor_rect is None:
+			return
+		refresher.damage(self, self.cursor_rect)
 	
 	def mouseUp_(self, event):
 		if event.clickCount() < 2:
@@ -1176,6 +2029,8 @@ class SlideView(NSView):
 
 
 class BoardView(NSView):
+	cursor_rect = None
+	
 	def initWithFrame_(self, frame):
 		assert NSView.initWithFrame_(self, frame) == self
 		self.setCanDrawConcurrently_(True)
@@ -1186,12 +2041,21 @@ class BoardView(NSView):
 		_, (w, h) = bounds = self.bounds()
 		NSEraseRect(bounds)
 
-		for path, color, size in drawings[BOARD]:
-			stroke(path, color, outline=None, size=size)
+		draw_ink(self, [BOARD], NSAffineTransform.transform(), outline=None,
+		         selection=presenter_view.selection)
 
 		x, y = cursor_location
 		iw, ih = 1./slide_view.cursor_scale, 1./slide_view.cursor_scale
 		draw_cursor(x, y, iw, ih)
+		self.cursor_rect = cursor_bounds(x, y, iw, ih)
+	
+	def damageCursor(self):
+		"""redraw where the cursor was and where it is now"""
+		x, y = cursor_location
+		iw, ih = 1./slide_view.cursor_scale, 1./slide_view.cursor_scale
+		refresher.damage(self, cursor_bounds(x, y, iw, ih))
+		if self.cursor_rect is not None:
+			refresher.damage(self, self.cursor_rect)
 
 
 class MovieView(NSView):
@@ -1420,39 +2284,69 @@ class PresenterView(NSView):
 	annotation_state = None
 	notes_scale = .75
 	target_page = ""
+	target_label = None
 	miniature_origin = 0
 	page_state = None
 	page = None
 	state = IDLE
 	selection_rect = NSZeroRect
-	selection = []
+	selection = frozenset() # ids of the selected strokes
 	preview_page = None
-	
+	collapsed = False
+	miniatures_state = None
+	notes_rect = NSZeroRect
+	
+	
+	def layout_miniatures(self):
+		"""lay out miniatures again when expanded frames change, keeping the
+		hovered (or current) miniature in place"""
+		expanded_pages = current_page, self.preview_page
+		state = self.collapsed and tuple(
+			None if page is None else navigation.frame(page)
+			for page in expanded_pages
+		)
+		if state == self.miniatures_state:
+			return
+		self.miniatures_state = state
+		anchor = current_page if self.preview_page is None else self.preview_page
+		anchor_origin = thumbnails[miniature_index[anchor]][2] if anchor in miniature_index else None
+		layout_miniatures(self.collapsed, expanded_pages)
+		if anchor_origin is not None:
+			self.miniature_origin += thumbnails[miniature_index[anchor]][2] - anchor_origin
 	
 	def draw_miniatures(self):
 		_, (width, height) = self.bounds()
 		x = width - MINIATURE_WIDTH
 		width = MINIATURE_WIDTH-MINIATURE_MARGIN
 		
+		self.layout_miniatures()
 		if self.page_state != current_page: # ensure current page in view when page changed
 			self.page_state = current_page
-			(_, h, o), _ = thumbnails[current_page]
+			_, h, o = thumbnails[miniature_index[current_page]]
 			self.miniature_origin = min(o-MINIATURE_MARGIN, self.miniature_origin)
 			self.miniature_origin = max(self.miniature_origin, o+h+MINIATURE_MARGIN-height)
 		
 		self.miniature_origin = min(MINIATURES_HEIGHT-height, self.miniature_origin)
 		self.miniature_origin = max(self.miniature_origin, -MINIATURE_MARGIN)
 		
-		for i in range(page_count):
-			(w, h, o), image = thumbnails[i]
+		ahead = [] # pages within a screen of the visible ones
+		wanted = []
+		for m in thumbnails.between(self.miniature_origin-height, self.miniature_origin+2*height):
+			w, h, o = thumbnails[m]
+			i = miniature_pages[m]
 			y = self.miniature_origin+height-o-h
-			if y < -h:
-				break
-			if y > height:
+			if y < -h or y > height:
+				ahead.append(i)
 				continue
-			image.drawInRect_fromRect_operation_fraction_(
-				((x, y), (w, h)), NSZeroRect, NSCompositingOperationCopy, 1.
-			)
+			image = thumbnail_images.get(i)
+			if image is None: # not rendered yet
+				wanted.append(i)
+				NSColor.darkGrayColor().setFill()
+				NSRectFill(((x, y), (w, h)))
+			else:
+				image.drawInRect_fromRect_operation_fraction_(
+					((x, y), (w, h)), NSZeroRect, NSCompositingOperationCopy, 1.
+				)
 			if i == current_page:
 				NSColor.yellowColor().setFill()
 				NSFrameRectWithWidth(((x, y), (w, h)), 2)
@@ -1468,6 +2362,8 @@ class PresenterView(NSView):
 				NSParagraphStyleAttributeName:  right_align,
 			}
 			page_number.drawInRect_withAttributes_(((x-52, y+h-12), (50, 15)), attr)
+		
+		thumbnailer.request(wanted + ahead)
 	
 	
 	def drawRect_(self, rect):
@@ -1522,7 +2418,7 @@ class PresenterView(NSView):
 		else:
 			bbox = slide_bbox
 			bbox.concat()
-			draw_page(self.page)
+			draw_cached_page(self, self.page, transform, bbox)
 
 			it = NSAffineTransform.alloc().initWithTransform_(transform)
 			it.prependTransform_(bbox)
@@ -1531,37 +2427,29 @@ class PresenterView(NSView):
 			
 			# links and movies
 			NSColor.blueColor().setFill()
-			for annotation in annotations(self.page):
-				bounds = annotation.bounds()
-				if annotation.type() in ['Link', 'Widget'] and annotation.shouldDisplay():
+			links = page_links(current_page)
+			for annotation, bounds in zip(links.annotations, links.grid.rects):
+				if annotation.shouldDisplay():
 					NSFrameRectWithWidth(bounds, .5)
-
-				if annotation in movies:
-					_, poster = movies[annotation]
-					if poster is None:
-						continue
-					if bounds.size.height < MIN_POSTER_HEIGHT:
-						continue
-					
-					rect = ((bounds.origin.x+bounds.size.width-icon_size.width-3, bounds.origin.y+bounds.size.height/6+3), icon_size)
-					NSColor.colorWithCalibratedWhite_alpha_(0., 0.5).setFill()
-					NSRectFillUsingOperation(rect, NSCompositingOperationDarken)
-					NSColor.whiteColor().setFill()
-					FULL_SCREEN.drawInRect_fromRect_operation_fraction_(
-						rect,
-						NSZeroRect,
-						NSCompositingOperationSourceAtop,
-						1.
-					)
-
-		for p in frame_pages[page]:
-			for path, color, size in drawings[p]:
-				stroke(
-					path, color,
-					outline=None if (path, color, size) not in self.selection else NSColor.yellowColor(),
-					size=size
+			
+			for placement in media.get(current_page, ()):
+				x, y = placement.icon_anchor
+				rect = ((x-icon_size.width, y), icon_size)
+				NSColor.colorWithCalibratedWhite_alpha_(0., 0.5).setFill()
+				NSRectFillUsingOperation(rect, NSCompositingOperationDarken)
+				NSColor.whiteColor().setFill()
+				FULL_SCREEN.drawInRect_fromRect_operation_fraction_(
+					rect,
+					NSZeroRect,
+					NSCompositingOperationSourceAtop,
+					1.
 				)
 
+		to_view = NSAffineTransform.alloc().initWithTransform_(bbox)
+		to_view.appendTransform_(transform)
+		draw_ink(self, frame_pages(page), to_view, outline=None,
+		         selection=self.selection, selection_outline=NSColor.yellowColor())
+
 		self.transform = transform
 		self.transform.prependTransform_(bbox)
 		self.resetCursorRects()
@@ -1596,24 +2484,10 @@ class PresenterView(NSView):
 		if self.state == DRAW:
 			return
 		
-		# time
-		now = time.time()
-		if now - self.duration_change_time <= 1: # duration changed, display it
-			clock = time.gmtime(self.duration)
-		elif self.absolute_time:
-			clock = time.localtime(now)
-		else:
-			running_duration = now - self.start_time + self.elapsed_duration
-			clock = time.gmtime(abs(self.duration - running_duration))
-		clock = _s(time.strftime("%H:%M:%S", clock))
-		clock.drawAtPoint_withAttributes_((margin, height-1.4*margin), {
-			NSFontAttributeName:            NSFont.labelFontOfSize_(margin),
-			NSForegroundColorAttributeName: NSColor.whiteColor(),
-		})
-		app.dockTile().setBadgeLabel_(clock)
-		
 		# page number
-		if self.target_page:
+		if self.target_label is not None:
+			page_number = _s("goto (%s)" % self.target_label)
+		elif self.target_page:
 			page_number = _s("goto %s/%s" % (
 				self.target_page, page_count))
 		else:
@@ -1628,6 +2502,11 @@ class PresenterView(NSView):
 		page_number.drawInRect_withAttributes_(((margin+current_width-500,
 		                                         height-1.4*margin), (500, font_size*1.2)), attr)
 		
+		# scanning progress
+		if scanner.progress() < 1.:
+			NSColor.grayColor().setFill()
+			NSRectFill(((margin, height-1.5*margin+2), (current_width*scanner.progress(), 2)))
+		
 		if page in durations or page in autoplay_animations:
 			PLAY.drawAtPoint_fromRect_operation_fraction_(
 				(margin+current_width-20, height-1.5*margin-18),
@@ -1640,8 +2519,9 @@ class PresenterView(NSView):
 			"\n\n".join(notes[current_page])
 			for notes in [pdf_notes, beamer_notes]
 		))
+		self.notes_rect = ((margin, font_size), (current_width, height-current_height-2.5*margin))
 		note.drawInRect_withAttributes_(
-			((margin, font_size), (current_width, height-current_height-2.5*margin)),
+			self.notes_rect,
 			{
 				NSFontAttributeName:            NSFont.labelFontOfSize_(font_size*self.notes_scale),
 				NSForegroundColorAttributeName: NSColor.whiteColor(),
@@ -1690,8 +2570,7 @@ class PresenterView(NSView):
 		transform.translateXBy_yBy_(0., -h)
 		transform.concat()
 		
-		NSEraseRect(page_rect)
-		next_page.drawWithBox_(kPDFDisplayBoxCropBox)
+		draw_cached_page(self, next_page, transform, None)
 
 		
 		NSColor.colorWithCalibratedWhite_alpha_(.25, .25).setFill()
@@ -1711,7 +2590,8 @@ class PresenterView(NSView):
 		if self.page is None:
 			return
 		
-		annotation_state = (self.transform.transformStruct(), current_page, board_view.isHidden())
+		links = page_links(current_page)
+		annotation_state = (self.transform.transformStruct(), links, board_view.isHidden())
 		if self.annotation_state == annotation_state:
 			return
 		self.annotation_state = annotation_state
@@ -1723,26 +2603,40 @@ class PresenterView(NSView):
 		if not board_view.isHidden():
 			return
 		
-		for i, annotation in enumerate(annotations(self.page)):
-			if annotation.type() not in ['Link', 'Widget']:
-				continue
-			if not annotation.shouldDisplay():
+		m11, m12, m21, m22, tX, tY = transform_matrix(self.transform)
+		cursor = NSCursor.pointingHandCursor()
+		for i, ((x, y), (w, h)) in enumerate(links.grid.rects):
+			if not links.annotations[i].shouldDisplay():
 				continue
 			
-			rect = transform_rect(self.transform, annotation.bounds())
-			self.addCursorRect_cursor_(rect, NSCursor.pointingHandCursor())
+			rect = ((m11*x + m21*y + tX, m12*x + m22*y + tY), (m11*w + m21*h, m12*w + m22*h))
+			self.addCursorRect_cursor_(rect, cursor)
 			self.addToolTipRect_owner_userData_(rect, self, i)
 	
 	
 	def view_stringForToolTip_point_userData_(self, view, tag, point, data):
-		annotation = annotations(self.page)[data]
-		return annotation.toolTip() or ""
+		return page_links(current_page).tooltips[data]
 	
 	def zoomAt_by_(self, point, percent):
 		bbox = slide_bbox if board_view.isHidden() else board_bbox
+		before = transform_matrix(bbox)
 		bbox.translateXBy_yBy_(point.x, point.y)
 		bbox.scaleBy_(exp(percent*0.01))
 		bbox.translateXBy_yBy_(-point.x, -point.y)
+		history.push(BBoxChange(bbox, before))
+		record_bboxes()
+	
+	def undo_(self, redo=False):
+		command = history.redo() if redo else history.undo()
+		if command is None:
+			return
+		self.selection = frozenset()
+		ink_rasters.clear()
+		for page in command.pages:
+			record_ink(page)
+		if isinstance(command, BBoxChange):
+			record_bboxes()
+		refresher.refresh()
 	
 	def keyDown_(self, event):
 		def send(c): # resend event with modified character
@@ -1752,6 +2646,21 @@ class PresenterView(NSView):
 		
 		c = event.characters()
 		
+		if self.target_label is not None: # typing a page label
+			if c == CR:
+				page = navigation.page(self.target_label)
+				if page is not None:
+					goto_page(page)
+				self.target_label = None
+			elif c == DEL:
+				self.target_label = self.target_label[:-1]
+			elif c == ESC:
+				self.target_label = None
+			else:
+				self.target_label += c
+			refresher.refresh()
+			return
+		
 		if hasModifiers(event, NSCommandKeyMask):
 			c = event.charactersIgnoringModifiers()
 			if c in "+=-_0)i": # slides scale
@@ -1764,12 +2673,15 @@ class PresenterView(NSView):
 				elif c == '-':
 					self.zoomAt_by_(cursor_location, -5)
 				else: # reset bbox to identity
-					if board_view.isHidden():
-						global slide_bbox
-						slide_bbox = NSAffineTransform.transform()
-					else:
-						global board_bbox
-						board_bbox = NSAffineTransform.transform()
+					bbox = slide_bbox if board_view.isHidden() else board_bbox
+					before = transform_matrix(bbox)
+					bbox.setTransformStruct_(ink.IDENTITY)
+					history.push(BBoxChange(bbox, before))
+					record_bboxes()
+				return
+			
+			elif c in "zZ" and video_view.isHidden(): # undo/redo
+				self.undo_(redo=(c == 'Z'))
 				return
 			
 			elif c in "zqwasd": # video position
@@ -1807,14 +2719,10 @@ class PresenterView(NSView):
 				else:
 					page = current_page if board_view.isHidden() else BOARD
 					if self.selection:
-						for path in self.selection:
-							try:
-								drawings[page].remove(path)
-							except ValueError:
-								continue
-						self.selection = []
-					else:
-						drawings[page] = drawings[page][:-1]
+						self.deleteSelectionOnPage_(page)
+					elif drawings[page]:
+						history.push(ink.DeleteStrokes(drawings, {page: [len(drawings[page])-1]}))
+					record_ink(page)
 			else:
 				self.target_page += c
 		
@@ -1857,7 +2765,8 @@ class PresenterView(NSView):
 					k = a.valueForAnnotationKey_('T')
 					if k.startswith('anm'):
 						a = int(k[len('anm'):])
-						advance_animation(a, step)
+						if a in animations: # page may not be scanned yet
+							advance_animation(a, step)
 						break
 			else:
 				movie_view.stepByCount_(step)
@@ -1869,6 +2778,8 @@ class PresenterView(NSView):
 				self.elapsed_duration += (now - self.start_time)
 			else:
 				self.start_time = now
+			record_timer()
+			clock_view.tick_(None)
 		
 		elif c in "z[]{}": # timer management
 			self.start_time = time.time()
@@ -1883,6 +2794,8 @@ class PresenterView(NSView):
 			}[c]
 			self.duration = max(0, self.duration)
 			self.duration_change_time = time.time()
+			record_timer()
+			clock_view.tick_(None)
 		
 		elif c in "+=-_0)": # notes or web view scale
 			if c == '=': c = '+'
@@ -1895,6 +2808,8 @@ class PresenterView(NSView):
 					self.notes_scale /= 1.1
 				else:
 					self.notes_scale = 1.
+				refresher.damage(self, self.notes_rect)
+				return
 			else:                   # scaling web view
 				magnification = web_view.magnification()
 				if c == '+':
@@ -1925,21 +2840,24 @@ class PresenterView(NSView):
 		elif c == 'e': # erase annotation
 			page = current_page if board_view.isHidden() else BOARD
 			if self.selection:
-				for path in self.selection:
-					try:
-						drawings[page].remove(path)
-					except ValueError:
-						continue
-				self.selection = []
+				self.deleteSelectionOnPage_(page)
+				record_ink(page)
 			else:
-				for end_frame in frames:
-					if end_frame > page:
-						break
-				for p in range(page, end_frame):
-					try:
-						del drawings[p]
-					except KeyError:
-						pass
+				_, end_frame = (BOARD, BOARD+1) if page == BOARD else navigation.frame(page)
+				erased = {p: range(len(drawings[p])) for p in range(page, end_frame) if drawings.get(p)}
+				if erased:
+					history.push(ink.DeleteStrokes(drawings, erased))
+				for p in erased:
+					record_ink(p)
+		
+		elif c == 'E': # export annotations
+			export_ink()
+		
+		elif c == 'g': # goto page label
+			self.target_label = ''
+		
+		elif c == 'o': # toggle collapsed miniatures
+			self.collapsed = not self.collapsed
 		
 		elif c == 'V': # toggle video size
 			video_view.toggle_size()
@@ -1989,23 +2907,30 @@ class PresenterView(NSView):
 	def pageAt_(self, point):
 		_, (_, height) = self.bounds()
 		ex, ey = point
-		for i in range(page_count):
-			(_, h, o), _ = thumbnails[i]
-			if ey + h + MINIATURE_MARGIN > self.miniature_origin-o+height:
-				break
-		return i
+		return miniature_pages[thumbnails.at(self.miniature_origin+height-ey)]
 	
 	
 	def startPathOnPage_(self, page):
-		self.path = NSBezierPath.bezierPath()
-		self.path.setLineCapStyle_(NSRoundLineCapStyle)
-		self.path.setLineJoinStyle_(NSRoundLineJoinStyle)
-		self.path.moveToPoint_(self.press_location)
-		self.path.lineToPoint_(cursor_location)
-		drawings[page].append((
-			self.path, color_chooser.color(),
-			slide_view.cursor_scale*(3 if page == BOARD else 1)
-		))
+		x, y = self.press_location
+		drawings[page].add(x, y, color_components(color_chooser.color()),
+		                   slide_view.cursor_scale*(3 if page == BOARD else 1))
+		drawings[page].add_point(*cursor_location)
+		self.last_location = cursor_location
+	
+	def tolerance(self):
+		"""simplification tolerance of strokes, in page units"""
+		if board_view.isHidden() and slide_view.page_to_view is not None:
+			_, scale = slide_view.page_to_view.transformSize_((0, 1))
+			return SIMPLIFY_TOLERANCE / abs(scale)
+		return SIMPLIFY_TOLERANCE
+	
+	def selectionIndicesOnPage_(self, page):
+		strokes = drawings[page]
+		return [i for i in map(strokes.index, self.selection) if i is not None]
+	
+	def deleteSelectionOnPage_(self, page):
+		history.push(ink.DeleteStrokes(drawings, {page: self.selectionIndicesOnPage_(page)}))
+		self.selection = frozenset()
 	
 	def transformSelectionBy_(self, t):
 		if board_view.isHidden():
@@ -2014,11 +2939,9 @@ class PresenterView(NSView):
 		else:
 			page = BOARD
 			view = board_view
-		for path in drawings[page]:
-			if path not in self.selection:
-				continue
-			b, _, _ = path
-			b.transformUsingAffineTransform_(t)
+		history.push(ink.TransformStrokes(drawings, page, self.selection, transform_matrix(t)))
+		if self.state != DRAG: # journaled on mouse up otherwise
+			record_ink(page)
 		refresher.refresh([view])
 	
 	def click(self):
@@ -2029,12 +2952,14 @@ class PresenterView(NSView):
 				video_view.start(switch_device=True)
 				return
 
-		annotation = self.page.annotationAtPoint_(self.press_location)
-		if annotation is None:
+		links = page_links(current_page)
+		i = links.at(self.press_location)
+		if i is None:
 			#next_page()
 			return
+		annotation = links.annotations[i]
 		
-		if annotation.type() not in ['Link', 'Widget']:
+		if annotation in probing or not scanner.is_scanned(current_page):
 			return
 		
 		if annotation in movies:
@@ -2067,8 +2992,8 @@ class PresenterView(NSView):
 			handle_animation(annotation)
 			return
 		
-		destination = annotation.destination()
-		url = annotation.URL()
+		destination = links.pages[i]
+		url = links.urls[i]
 		
 		if type(action) == PDFActionNamed:
 			action_name = action.name()
@@ -2085,8 +3010,8 @@ class PresenterView(NSView):
 			}.get(action_name, nop)
 			action()
 		
-		elif destination:
-			goto_page(pdf.indexForPage_(destination.page()))
+		elif destination is not None:
+			goto_page(destination)
 		
 		elif url:
 			if not use_youtube:
@@ -2103,7 +3028,7 @@ class PresenterView(NSView):
 			self.zoomAt_by_(center, event.deltaY())
 		elif self.inMiniaturesAt_(location):
 			if not event.phase(): # mouse vs. gesture
-				(_, h, _), _ = thumbnails[current_page]
+				_, h, _ = thumbnails[miniature_index[current_page]]
 				h += MINIATURE_MARGIN
 				if event.scrollingDeltaY() < 0:
 					h = -h
@@ -2143,6 +3068,7 @@ class PresenterView(NSView):
 			if not movie_view.isHidden():
 				presentation_show()
 			self.state = BBOX
+			self.bbox_before = transform_matrix(slide_bbox if board_view.isHidden() else board_bbox)
 		elif hasModifiers(event, NSAlternateKeyMask): # starting a selection
 			self.state = SELECT
 		elif (
@@ -2164,8 +3090,8 @@ class PresenterView(NSView):
 		location = event.locationInWindow()
 		cursor_location = self.transform.transformPoint_(location)
 		slide_view.showCursor()
-		if not board_view.isHidden(): # no real time drawing for slide because it's too slow
-			refresher.refresh([board_view])
+		if not board_view.isHidden():
+			board_view.damageCursor()
 		
 		if self.inMiniaturesAt_(location):
 			i = self.pageAt_(location)
@@ -2203,27 +3129,58 @@ class PresenterView(NSView):
 			self.startPathOnPage_(page)
 			self.state = DRAW
 		elif self.state == DRAW:
-			self.path.lineToPoint_(cursor_location)
-			if not board_view.isHidden(): # no real time drawing for slide because it's too slow
-				refresher.refresh([board_view])
+			strokes = drawings[current_page if board_view.isHidden() else BOARD]
+			previous_location = self.last_location
+			point_count = strokes.point_count(len(strokes)-1)
+			strokes.add_point(*cursor_location, tolerance=self.tolerance())
+			add_ink_segment(strokes, previous_location, cursor_location, point_count)
+			self.last_location = cursor_location
+			self.damageSegment_(previous_location)
+			return
 		elif self.state == DRAG:
 			t = NSAffineTransform.transform()
 			t.translateXBy_yBy_(dx, dy)
 			self.transformSelectionBy_(t)
 		self.display()
 	
+	def damageSegment_(self, previous_location):
+		"""redraw only the last segment of the path being drawn"""
+		strokes = drawings[current_page if board_view.isHidden() else BOARD]
+		size = strokes.width(len(strokes)-1)
+		(x0, y0), (x1, y1) = previous_location, cursor_location
+		rect = NSInsetRect(((min(x0, x1), min(y0, y1)), (abs(x1-x0), abs(y1-y0))), -size, -size)
+		view_rect = transform_rect(self.page_to_view(), rect)
+		refresher.damage(self, view_rect)
+		if board_view.isHidden():
+			slide_view.damagePageRect_(rect)
+			slide_view.damageCursor()
+		else:
+			board_view.damageCursor()
+			refresher.damage(board_view, rect)
+	
+	def page_to_view(self):
+		to_view = NSAffineTransform.alloc().initWithTransform_(self.transform)
+		to_view.invert()
+		return to_view
+	
 	def mouseUp_(self, event):
+		if self.state in [DRAW, DRAG]:
+			page = current_page if board_view.isHidden() else BOARD
+			drawings[page].bake()
+			if self.state == DRAW:
+				history.push(ink.AddStroke(drawings, page, drawings[page].ids[-1]))
+			record_ink(page)
+		elif self.state == BBOX:
+			history.push(BBoxChange(slide_bbox if board_view.isHidden() else board_bbox, self.bbox_before))
+			record_bboxes()
 		if self.state == MIN_CLIC:
 			i = self.pageAt_(event.locationInWindow())
 			goto_page(i)
 		elif self.state == CLIC:
 			self.click()
 		elif self.state == SELECT:
-			self.selection = [
-				(path, color, size)
-				for path, color, size in drawings[current_page if board_view.isHidden() else BOARD]
-				if NSContainsRect(self.selection_rect, path.bounds()) or NSPointInRect(path.currentPoint(), self.selection_rect)
-			]
+			strokes = drawings[current_page if board_view.isHidden() else BOARD]
+			self.selection = frozenset(strokes.ids[i] for i in strokes.select(self.selection_rect))
 			self.selection_rect = NSZeroRect
 		slide_view.showCursor()
 		self.state = IDLE
@@ -2234,6 +3191,64 @@ class PresenterView(NSView):
 	#	refresher.refresh()
 
 
+# clock view ################################################################
+
+# the clock (or timer) is drawn in its own opaque view on top of the presenter
+# view, so that ticking every second redraws neither the presenter view nor the
+# slides below, and only when the displayed time changes
+
+class ClockView(NSView):
+	clock = _s("")
+	
+	def isOpaque(self):
+		return True
+	
+	def hitTest_(self, point):
+		return None # events go to the presenter view
+	
+	def margin(self):
+		width, _ = self.superview().bounds().size
+		return (width - MINIATURE_WIDTH) / 20.
+	
+	def attributes(self):
+		return {
+			NSFontAttributeName:            NSFont.labelFontOfSize_(self.margin()),
+			NSForegroundColorAttributeName: NSColor.whiteColor(),
+		}
+	
+	def resizeWithOldSuperviewSize_(self, size):
+		# top left of the presenter view, above the scanning progress bar
+		_, height = self.superview().bounds().size
+		margin = self.margin()
+		width, _ = _s("00:00:00").sizeWithAttributes_(self.attributes())
+		self.setFrame_(((margin, height-1.5*margin+4), (width+margin/2., 1.5*margin-4)))
+	
+	def text(self):
+		presenter = self.superview()
+		now = time.time()
+		if now - presenter.duration_change_time <= 1: # duration changed, display it
+			clock = time.gmtime(presenter.duration)
+		elif presenter.absolute_time:
+			clock = time.localtime(now)
+		else:
+			running_duration = now - presenter.start_time + presenter.elapsed_duration
+			clock = time.gmtime(abs(presenter.duration - running_duration))
+		return _s(time.strftime("%H:%M:%S", clock))
+	
+	def tick_(self, timer):
+		clock = self.text()
+		if clock == self.clock:
+			return
+		self.clock = clock
+		self.setNeedsDisplay_(True)
+		app.dockTile().setBadgeLabel_(clock)
+	
+	def drawRect_(self, rect):
+		NSColor.blackColor().setFill()
+		NSRectFill(rect)
+		self.clock.drawAtPoint_withAttributes_((0, .1*self.margin()-4), self.attributes())
+
+
 # application delegate ######################################################
 
 # menus
@@ -2376,10 +3391,13 @@ class ApplicationDelegate(NSObject):
 		toggle_fullscreen(fullscreen=self.fullscreen)
 	
 	def applicationWillTerminate_(self, notification):
+		NSLog("rendered pages cache: %@, %@", rendered_pages.stats(), prefetcher.stats())
 		recent_files[url.path()] = current_page
 		user_defaults.setObject_forKey_(recent_files, RECENT_FILES)
+		if session_journal is not None:
+			session_journal.close(remove=True)
+			NSLog("session journal: %@", session_journal.stats())
 		presentation_show()
-		cleanup_tmp()
 	
 	def fullScreen_(self, sender):
 		toggle_fullscreen(fullscreen=True)
@@ -2502,6 +3520,14 @@ presentation_show()
 presenter_window = create_window(file_name)
 presenter_view   = create_view(PresenterView, window=presenter_window)
 
+clock_view = ClockView.alloc().initWithFrame_(NSZeroRect)
+add_subview(presenter_view, clock_view, NSViewNotSizable)
+clock_view.resizeWithOldSuperviewSize_((0, 0))
+
+if 'timer' in recovered:
+	p = presenter_view
+	p.duration, p.elapsed_duration, p.start_time, p.absolute_time = recovered['timer']
+
 presenter_window.center()
 presenter_window.makeFirstResponder_(presenter_view)
 presentation_window.makeFirstResponder_(presenter_view)
@@ -2567,11 +3593,26 @@ class Refresher(NSObject):
 			view.setNeedsDisplay_(True)
 			for subview in view.subviews():
 				views.append(subview)
+	
+	def damage(self, view, rect):
+		"""redraw only rect of view (in its coordinates), with a margin for antialiasing"""
+		view.setNeedsDisplayInRect_(NSInsetRect(rect, -2, -2))
 refresher = Refresher.alloc().init()
 
-refresher_timer = NSTimer.scheduledTimerWithTimeInterval_target_selector_userInfo_repeats_(
+
+clock_timer = NSTimer.scheduledTimerWithTimeInterval_target_selector_userInfo_repeats_(
 	1.,
-	refresher, "refresh:",
-	[presenter_view], YES)
+	clock_view, "tick:",
+	nil, YES)
+clock_timer.setTolerance_(.1) # lets the system coalesce wake ups
+clock_view.tick_(None)
+
+try:
+	session_journal = journal.Journal(JOURNAL_PATH, _document_key, session_snapshot())
+except OSError as e:
+	NSLog("unable to start session journal: %@", str(e))
+
+scanner.start()
+thumbnailer.start()
 
 sys.exit(app.run())